@@ -4,7 +4,7 @@ from test.connect4 import ConnectFourGame
 
 def main():
     result = (MCTS(ConnectFourGame)
-              .get_simulation_result(1000, get_leaf_nodes=True))
+              .get_simulation_result(1000, get_walks=True))
     flamegraph(result)
 
 
@@ -19,8 +19,10 @@ def dump_state(state, children=None, move=None):
         children = []
 
     if state.current_player == 0:
+        visits = sum(child.visits for child in children) or 1
         overall_percent = (sum(child.wins_by_player[0]
-                               for child in children) / 1000.0) * 100
+                               for child in children) /
+                           float(visits)) * 100
     else:
         overall_percent = None
 
@@ -30,7 +32,9 @@ def dump_state(state, children=None, move=None):
                      'wins': child.wins_by_player[child.parent.current_player]}
         for child in children}
 
-    print(dumps({'state': state.__dict__,
+    # the board is only built from the bitboards for the browser
+    state = dict(state._asdict(), board=ConnectFourGame.board(state))
+    print(dumps({'state': state,
                  'children': children,
                  'overall_percent': overall_percent,
                  'error': None},
@@ -40,15 +44,16 @@ def dump_state(state, children=None, move=None):
 
 def main():
     state = ConnectFourGame.initial_state()
+    # keep one search tree for the whole game so the statistics under the
+    # moves that were played are reused by the next search
+    mcts = MCTS(ConnectFourGame, state)
     while True:
         winner = ConnectFourGame.get_winner(state)
         if winner is not None:
             dump_state(state)
             break
         legal_moves = ConnectFourGame.get_moves(state)[1]
-        result = (
-            MCTS(ConnectFourGame, state)
-            .get_simulation_result(1000))
+        result = mcts.get_simulation_result(1000)
         move = result.move
         dump_state(state, result.root.children, move)
         if state.current_player == 0:
@@ -57,11 +62,13 @@ def main():
                     move = int(input(''))
                     assert move in legal_moves
                     state = ConnectFourGame.apply_move(state, move)
+                    mcts.advance(move, state)
                     break
                 except (AssertionError, ValueError):
                     print(dumps({'error': 'That is not a legal move'}))
         else:
             state = ConnectFourGame.apply_move(state, move)
+            mcts.advance(move, state)
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ from test.euchre import EuchreGame
 def main():
     state = EuchreGame.initial_state(['ad', '0d', 'kd', '0s', '9s'], trump='d')
     result = (MCTS(EuchreGame, state)
-              .get_simulation_result(1000, get_leaf_nodes=True))
+              .get_simulation_result(1000, get_walks=True))
     flamegraph(result)
 
 
@@ -22,8 +22,10 @@ def dump_state(state, hands, children=None, move=None, table=None):
         table = []
 
     if state.current_player == 0:
+        visits = sum(child.visits for child in children) or 1
         overall_percent = (sum(child.wins_by_player[0]
-                               for child in children) / 1000.0) * 100
+                               for child in children) /
+                           float(visits)) * 100
     else:
         overall_percent = None
 
@@ -43,26 +45,44 @@ def dump_state(state, hands, children=None, move=None, table=None):
     stdout.flush()
 
 
+def seen_by(state, hands, player):
+    """The state as player sees it: only their own hand is known"""
+    return state._replace(hands=[seat == player and hand[:] or []
+                                 for seat, hand in enumerate(hands)])
+
+
 def main():
     state = EuchreGame.initial_state()
     hands = EuchreGame.determine(state).hands
     table = [None] * 4
+    # every seat keeps its own search tree: a tree searched by another seat
+    # was built knowing that seat's hand
+    searches = {}
+    # the moves played since every seat last searched and the states the
+    # seat saw after them
+    unseen_moves = dict((player, []) for player in range(4))
     while True:
         winner = EuchreGame.get_winner(state)
         if winner is not None:
             dump_state(state, hands)
             break
-        state_hands = [player == state.current_player and hand[:] or []
-                       for player, hand in enumerate(hands)]
-        state = state._replace(hands=state_hands)
+        player = state.current_player
+        state = seen_by(state, hands, player)
         actual_options = playable_cards(state.trump,
                                         suit(state.trump,
                                              state.lead_card),
                                         hands[state.current_player])
         legal_moves = EuchreGame.get_moves(state)[1]
-        result = (
-            MCTS(EuchreGame, state)
-            .get_simulation_result(1000, actual_options))
+        # each search starts from the statistics the seat gathered under
+        # the moves played since its last search
+        mcts = searches.get(player)
+        if mcts is None:
+            mcts = searches[player] = MCTS(EuchreGame, state)
+        else:
+            for move, seen_state in unseen_moves[player]:
+                mcts.advance(move, seen_state)
+        unseen_moves[player] = []
+        result = mcts.get_simulation_result(1000, actual_options)
         move = result.move
         dump_state(state, hands, result.root.children, move, table)
         if state.current_player == 0:
@@ -80,6 +100,8 @@ def main():
             hands[state.current_player].remove(move)
             table[state.current_player] = move
             state = EuchreGame.apply_move(state, move)
+        for seat, moves in unseen_moves.items():
+            moves.append((move, seen_by(state, hands, seat)))
         if len(filter(None, table)) == 4:
             dump_state(state, hands, result.root.children, move, table)
             table = [None] * 4
@@ -1,11 +1,24 @@
-from collections import defaultdict, namedtuple, Counter
+from collections import defaultdict, namedtuple, Counter, OrderedDict
 from copy import deepcopy
+import inspect
+import json
+from functools import partial
+from itertools import cycle
+import multiprocessing
+import random as global_random
+import sys
 from time import time
+try:
+    from time import perf_counter as clock
+except ImportError:  # Python 2
+    from time import time as clock
 
 from math import sqrt, log
-from random import choice, random
+from random import Random
+from threading import Event, Lock, Thread
 
 from six import iteritems
+from six.moves.queue import Full, Queue
 
 
 class Draw(object):
@@ -15,38 +28,284 @@ class Draw(object):
 Draw = Draw()
 
 
+# marks a memoized value that has not been computed (None is a valid winner)
+NOT_COMPUTED = object()
+
+
+MCTSResult = namedtuple('MCTSResult', 'root, move, leaf_nodes,'
+                                      'max_depth, avg_depth, iterations_saved,'
+                                      'walks, profile')
+# iterations_saved is the part of the iteration budget left when a search
+# stops early because its move is settled, walks the Counter of the
+# flamegraph walks recorded with get_walks and profile the Profile of a
+# search by MCTS(game, profile=True)
+MCTSResult.__new__.__defaults__ = (0, None, None)
+
+
+# early stopping checks whether the move of a search is settled every so
+# many iterations
+EARLY_STOP_CHECK_EVERY = 10
+
+
+# a snapshot of a search in progress: children are the MoveStats of the
+# visited moves at the root, most visited first, and win_rate counts a draw
+# as half a win for the player to move at the root
+Snapshot = namedtuple('Snapshot', 'iterations, seconds, iterations_per_second,'
+                                  'move, children, done')
+
+
+MoveStats = namedtuple('MoveStats', 'move, visits, win_rate')
+
+
+NO_WINNER_MESSAGE = ('A game cannot have a terminal node that has no '
+                     'winner. If the game was a draw return Draw')
+
+
+def make_random(seed=None):
+    """Returns the random number generator for a search: the global random
+    module for None, a new random.Random seeded with seed for anything else
+    and seed itself if it already is a random.Random"""
+    if seed is None:
+        return global_random
+    if isinstance(seed, Random):
+        return seed
+    return Random(seed)
+
+
+_takes_random = {}
+
+
+def takes_random(function):
+    """Game callbacks (initial_state, determine and rollout_policy) that
+    accept a random keyword argument are passed the random number generator
+    of the search so results can be reproduced"""
+    # look through the wrappers of a profiled game
+    function = getattr(function, '__wrapped__', function)
+    if function not in _takes_random:
+        getargspec = (getattr(inspect, 'getfullargspec', None) or
+                      inspect.getargspec)
+        try:
+            _takes_random[function] = 'random' in getargspec(function).args
+        except TypeError:
+            _takes_random[function] = False
+    return _takes_random[function]
+
+
+def determine(game, state, random):
+    if takes_random(game.determine):
+        return game.determine(state, random=random)
+    return game.determine(state)
+
+
+# the game callbacks timed by a profiled game
+CALLBACKS = ['initial_state', 'apply_move', 'get_moves', 'get_winner',
+             'current_player', 'determine', 'determinization_sampler',
+             'state_key', 'rollout_policy', 'update_misc']
+
+
+def _no_lap(phase=None):
+    pass
+
+
+class Profile(object):
+    """The time spent and the number of calls made in every phase of the
+    search iterations (prune, determine, select, rollout, evaluate,
+    backprop and prove) and in every game callback. Callbacks are also
+    counted in the phase they were called from."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.last_lap = None
+
+    def lap(self, phase=None):
+        now = clock()
+        if phase is not None:
+            key = ('phase', phase)
+            self.seconds[key] += now - self.last_lap
+            self.calls[key] += 1
+        self.last_lap = now
+
+    def timed(self, name, function):
+        seconds = self.seconds
+        calls = self.calls
+        key = ('callback', name)
+
+        def timed_function(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds[key] += clock() - start
+                calls[key] += 1
+        timed_function.__wrapped__ = function
+        return timed_function
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+
+    def copy(self):
+        profile = Profile()
+        profile.merge(self)
+        return profile
+
+    def merge(self, profile):
+        for key, seconds in iteritems(profile.seconds):
+            self.seconds[key] += seconds
+        for key, calls in iteritems(profile.calls):
+            self.calls[key] += calls
+
+    def to_dict(self):
+        profile = {'phases': {}, 'callbacks': {}}
+        for (kind, name), calls in sorted(iteritems(self.calls)):
+            profile[kind + 's'][name] = {'calls': calls,
+                                         'seconds': self.seconds[kind, name]}
+        return profile
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), sort_keys=True, **kwargs)
+
+    def to_prometheus(self, prefix='mittmcts', labels=None):
+        """The profile in the Prometheus text exposition format. labels are
+        added to every sample (e.g. {'game': 'connect4'})."""
+        labels = sorted(iteritems(labels or {}))
+        lines = []
+        for metric, values, description in [
+                ('seconds_total', self.seconds,
+                 'Time spent per search phase and game callback'),
+                ('calls_total', self.calls,
+                 'Calls per search phase and game callback')]:
+            name = '{}_{}'.format(prefix, metric)
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} counter'.format(name))
+            for (kind, key), value in sorted(iteritems(values)):
+                sample_labels = ','.join(
+                    '{}="{}"'.format(label, value)
+                    for label, value in labels + [('kind', kind),
+                                                  ('name', key)])
+                lines.append('{}{{{}}} {}'.format(name, sample_labels,
+                                                  value))
+        return '\n'.join(lines) + '\n'
+
+
+class ProfiledGame(object):
+    """Stands in for a game, timing its callbacks in profile. Anything else
+    is looked up on the game."""
+
+    def __init__(self, game, profile):
+        self.__game = game
+        for name in CALLBACKS:
+            callback = getattr(game, name, None)
+            if callback is not None:
+                setattr(self, name, profile.timed(name, callback))
+
+    def __getattr__(self, name):
+        return getattr(self.__game, name)
+
+
+class TranspositionTable(object):
+    """Maps the keys returned by a game's state_key to the node searching
+    that state so positions reached through different move orders share
+    one node. The least recently used entries are evicted once max_size
+    states are stored (nodes still referenced from the tree stay there)."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.nodes = OrderedDict()
+
+    def get(self, key):
+        node = self.nodes.pop(key, None)
+        if node is not None:
+            self.nodes[key] = node
+        return node
+
+    def add(self, key, node):
+        self.nodes[key] = node
+        while len(self.nodes) > self.max_size:
+            self.nodes.popitem(last=False)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
 class Node(object):
-    def __init__(self, game, state, parent, move, c, depth=0):
+    def __init__(self, game, state, parent, move, c, depth=0,
+                 transpositions=None, random=None, solver=False,
+                 budget=None, widening=None, chance_widening=None):
         self.parent = parent
         self.__state = state
         if parent is None:
             self.__initial_state = deepcopy(state)
         self.__children = {}
+        self.clear_cache()
         self.game = game
         self.move = move
         self.visits = 0
+        # the virtual losses of the threads searching below this node
+        self.virtual_visits = 0
         self.draws = 0
         self.wins_by_player = defaultdict(lambda: 0)
         self.misc_by_player = defaultdict(dict)
         self.impossible_state = False
         self.c = c
         self.depth = depth
+        self.transpositions = transpositions
+        # in solver mode proven is the winner of the game from this node
+        # under perfect play once that is known (see prove)
+        self.solver = solver
+        self.proven = None
+        # counts the nodes of the tree when the search has a node budget
+        self.budget = budget
+        # the move probabilities an evaluator gave once this node has been
+        # evaluated (empty without probabilities)
+        self.priors = None
+        # (k, alpha): progressive widening only lets the node have
+        # k * visits ** alpha children for its moves (widening) or for the
+        # outcomes of its random moves (chance_widening)
+        self.widening = widening
+        self.chance_widening = chance_widening
+        if random is None:
+            random = global_random
+        self.random = random
 
-    def ucb1(self, player):
-        if not self.parent:
-            return 0
+    def ucb1(self, player, parent_visits=None):
+        # nodes shared through a transposition table are scored with the
+        # visits of the parent selecting them rather than their first parent
+        if parent_visits is None:
+            if not self.parent:
+                return 0
+            parent_visits = self.parent.visits
         wins_by_player = self.wins_by_player.get(player, 0)
         try:
             ucb = (
                 (float(wins_by_player + (self.draws * 0.5)) / self.visits) +
-                (self.c * sqrt(log(self.parent.visits) / self.visits)))
-        except ZeroDivisionError:
+                (self.c * sqrt(log(parent_visits) / self.visits)))
+        except (ZeroDivisionError, ValueError):
+            # a shared node can already be visited when reached through a
+            # parent that has not been visited yet (log(0))
             ucb = 0
         return ucb
 
     @property
     def winner(self):
-        return self.game.get_winner(self.state)
+        if self.__winner is NOT_COMPUTED:
+            self.__winner = self.game.get_winner(self.state)
+        return self.__winner
+
+    def get_moves(self):
+        if self.__moves is None:
+            self.__moves = self.game.get_moves(self.state)
+        return self.__moves
+
+    def clear_cache(self):
+        # get_moves, winner, current_player and children are memoized for
+        # the current state
+        # of the node and have to be recomputed for every new determination
+        self.__moves = None
+        self.__winner = NOT_COMPUTED
+        self.__current_player = NOT_COMPUTED
+        self.__child_list = None
 
     @property
     def state(self):
@@ -54,53 +313,309 @@ class Node(object):
             self.__state = self.game.apply_move(self.parent.state, self.move)
         return self.__state
 
-    def determine(self):
+    def determine(self, determination=None):
         # if games implement a determine classmethod then we are
         # doing ISMCTS so we randomly pick the hidden state every time
-        # we play out
-        if hasattr(self.game, 'determine'):
-            self.__state = self.game.determine(self.__initial_state)
+        # we play out (unless a determination sampled ahead of time is given)
+        if determination is not None:
+            self.__state = determination
+            self.clear_cache()
+        elif hasattr(self.game, 'determine'):
+            self.__state = determine(self.game, self.__initial_state,
+                                     self.random)
+            self.clear_cache()
 
     def add_new_children_for_determination(self, moves):
-        self.__children.update({move: Node(game=self.game,
-                                           state=None,
-                                           move=move,
-                                           parent=self,
-                                           c=self.c,
-                                           depth=self.depth + 1)
+        self.__child_list = None
+        self.__children.update({move: self.new_child(move)
                                 for move in moves
                                 if move not in self.__children})
 
+    def new_child(self, move):
+        state = None
+        if self.transpositions is not None:
+            state = self.game.apply_move(self.state, move)
+            key = self.game.state_key(state)
+            child = self.transpositions.get(key)
+            if child is not None:
+                # no new node is needed
+                return child
+        if self.budget is not None:
+            self.budget.nodes += 1
+        child = Node(game=self.game,
+                     state=state,
+                     move=move,
+                     parent=self,
+                     c=self.c,
+                     depth=self.depth + 1,
+                     transpositions=self.transpositions,
+                     random=self.random,
+                     solver=self.solver,
+                     budget=self.budget,
+                     widening=self.widening,
+                     chance_widening=self.chance_widening)
+        if self.transpositions is not None:
+            self.transpositions.add(key, child)
+        return child
+
+    def expand_one(self):
+        """Returns a (child, expanded) tuple for selection in rollout mode.
+
+        Only one child is added per call: an untried move is picked at random
+        and expanded is True. Once every move has a child the best child is
+        returned instead. Random nodes sample an outcome and only add a child
+        the first time that outcome comes up. (None, False) is returned when
+        there are no moves or the child would exceed the node budget."""
+        is_random, moves = self.get_moves()
+        self.is_random = is_random
+        if not moves:
+            return None, False
+        if is_random and self.chance_widening is not None:
+            child = self.sample_outcome()
+            return child, child is not None and child.visits == 0
+        if is_random:
+            move = self.random.choice(moves)
+        else:
+            untried_moves = [move for move in moves
+                             if move not in self.__children]
+            if (untried_moves and self.widening is not None and
+                    len(moves) - len(untried_moves) >=
+                    widening_limit(self.widening, self.visits)):
+                untried_moves = []
+            if not untried_moves:
+                return self.get_best_child(), False
+            move = self.random.choice(untried_moves)
+        child = self.__children.get(move)
+        if child is not None:
+            return child, False
+        if self.budget is not None and self.budget.full:
+            return None, False
+        child = self.new_child(move)
+        self.__children[move] = child
+        self.__child_list = None
+        # a transposition that has been played out already is not new
+        return child, child.visits == 0
+
+    def get_child(self, move):
+        return self.__children.get(move)
+
+    def prune(self):
+        """Drops the subtree under this node, keeping the node's own
+        statistics, and returns the number of nodes dropped"""
+        dropped = tree_size(self) - 1
+        self.__children = {}
+        self.__child_list = None
+        return dropped
+
+    @property
+    def expanded_children(self):
+        """Every child added so far, including children for moves that are
+        not legal in the current determination"""
+        return list(self.__children.values())
+
     @property
     def children(self):
-        is_random, moves = self.game.get_moves(self.state)
+        is_random, moves = self.get_moves()
         self.is_random = is_random
-        self.add_new_children_for_determination(moves)
-        return [child for move, child in iteritems(self.__children)
-                if move in moves]
+        if self.__child_list is None:
+            widening = self.chance_widening if is_random else self.widening
+            if widening is None:
+                self.add_new_children_for_determination(moves)
+            # with progressive widening children are only added as the node
+            # is selected from (widen and sample_outcome)
+            self.__child_list = [child
+                                 for move, child in iteritems(self.__children)
+                                 if move in moves]
+        return self.__child_list
+
+    def widen(self):
+        """Adds a child for an untried move if the node has fewer children
+        than progressive widening allows and the node budget is not full.
+        The move with the highest prior of an evaluator is tried first,
+        else a random one."""
+        _, moves = self.get_moves()
+        children = self.children
+        if (len(children) >= min(len(moves),
+                                 widening_limit(self.widening, self.visits))
+                or (self.budget is not None and self.budget.full)):
+            return
+        untried_moves = [move for move in moves
+                         if move not in self.__children]
+        if self.priors:
+            priors = self.priors
+            move = max(untried_moves, key=lambda move: priors.get(move, 0))
+        else:
+            move = self.random.choice(untried_moves)
+        self.__children[move] = self.new_child(move)
+        self.__child_list = None
+
+    def sample_outcome(self):
+        """Double progressive widening: samples an outcome of this random
+        node and adds a child for it while the node has fewer children than
+        chance_widening allows. Otherwise an outcome already in the tree is
+        picked as often as it has been visited. Returns None when there is
+        no child and the node budget is full."""
+        _, moves = self.get_moves()
+        move = self.random.choice(moves)
+        child = self.__children.get(move)
+        if child is not None:
+            return child
+        children = self.children
+        if (len(children) < widening_limit(self.chance_widening, self.visits)
+                and not (self.budget is not None and self.budget.full)):
+            child = self.new_child(move)
+            self.__children[move] = child
+            self.__child_list = None
+            return child
+        if not children:
+            return None
+        point = self.random.randrange(sum(child.visits + 1
+                                          for child in children))
+        for child in children:
+            point -= child.visits + 1
+            if point < 0:
+                return child
 
     def get_best_child(self):
         # force instantiation of child nodes and get self.is_random set
         children = self.children
 
+        if self.is_random and self.chance_widening is not None:
+            child = self.sample_outcome()
+            if child is not None:
+                return child
+
+        if not self.is_random and self.widening is not None:
+            self.widen()
+            children = self.children
+
         if not children:
             raise ValueError('Need to have children to find the '
                              'best child')
 
         if self.is_random:
-            return choice(children)
+            return self.random.choice(children)
+
+        if self.solver:
+            # solved subtrees do not need to be searched any further
+            children = [child for child in children
+                        if child.proven is None] or children
+
+        if self.priors:
+            return self.get_best_child_by_prior(children)
+
+        if self.virtual_visits:
+            return self.get_best_child_with_virtual_loss(children)
 
         # visit unplayed moves first
+        unvisited = [child for child in children if child.visits == 0]
+        if unvisited:
+            return self.random.choice(unvisited)
+
         # if all moves have been visited then visit the move with the highest
-        # ucb1 payout
-        children = sorted(children,
-                          key=lambda c: (c.visits == 0 and random() or -1,
-                                         c.ucb1(self.current_player)))
-        return children[-1]
+        # ucb1 payout, scoring every child in one pass with the parent's log
+        # computed once (a shared node's parent may not be visited yet)
+        player = self.current_player
+        c = self.c
+        log_visits = self.visits and log(self.visits)
+        return max(children,
+                   key=lambda child: (
+                       (child.wins_by_player.get(player, 0) +
+                        child.draws * 0.5) / float(child.visits) +
+                       c * sqrt(log_visits / child.visits)))
+
+    def get_best_child_with_virtual_loss(self, children):
+        """Picks the best child like get_best_child while other threads are
+        searching below this node: their virtual visits count as losses so
+        the threads spread out over the tree"""
+        unvisited = [child for child in children
+                     if child.visits + child.virtual_visits == 0]
+        if unvisited:
+            return self.random.choice(unvisited)
+        player = self.current_player
+        c = self.c
+        log_visits = log(self.visits + self.virtual_visits)
+
+        def ucb1(child):
+            visits = float(child.visits + child.virtual_visits)
+            return ((child.wins_by_player.get(player, 0) +
+                     child.draws * 0.5) / visits +
+                    c * sqrt(log_visits / visits))
+        return max(children, key=ucb1)
+
+    def get_best_child_by_prior(self, children):
+        """Picks the child with the best PUCT score: its win rate plus an
+        exploration term weighted by the evaluator's probability for its
+        move that shrinks as the child is visited"""
+        player = self.current_player
+        priors = self.priors
+        c = self.c
+        sqrt_visits = sqrt(self.visits + self.virtual_visits)
+
+        def puct(child):
+            visits = child.visits + child.virtual_visits
+            score = 0
+            if visits:
+                score = ((child.wins_by_player.get(player, 0) +
+                          child.draws * 0.5) / float(visits))
+            return (score +
+                    c * priors.get(child.move, 0) * sqrt_visits / (1 + visits))
+        return max(children, key=puct)
+
+    def prove(self):
+        """Marks this node as proven if it is terminal or enough of its
+        children are proven: a child proven to win for the player to move
+        (or, at a random node, every child proven to have the same winner)
+        or every child proven, in which case the player to move draws if
+        they can. Returns whether the node is proven."""
+        if self.proven is not None:
+            return True
+        if self.winner is not None:
+            self.proven = self.winner
+            return True
+        is_random, moves = self.get_moves()
+        children = [self.__children.get(move) for move in moves]
+        if not is_random:
+            player = self.current_player
+            for child in children:
+                if child is not None and child.proven == player:
+                    self.proven = player
+                    return True
+        if not children or any(child is None or child.proven is None
+                               for child in children):
+            return False
+        winners = set(child.proven for child in children)
+        if is_random:
+            if len(winners) == 1:
+                self.proven = winners.pop()
+        elif Draw in winners:
+            self.proven = Draw
+        else:
+            self.proven = winners.pop()
+        return self.proven is not None
+
+    def best_solved_child(self, actual_options=None):
+        """The most visited child among the children that are proven to win
+        for the player to move, or else that are not proven to lose"""
+        children = self.children
+        if actual_options:
+            children = [child for child in children
+                        if child.move in actual_options]
+        if not children:
+            return self.most_visited_child(actual_options)
+        player = self.current_player
+
+        def rank(child):
+            if child.proven is None or child.proven is Draw:
+                return 1
+            return child.proven == player and 2 or 0
+        return max(children, key=lambda child: (rank(child), child.visits))
 
     @property
     def current_player(self):
-        return self.game.current_player(self.state)
+        if self.__current_player is NOT_COMPUTED:
+            self.__current_player = self.game.current_player(self.state)
+        return self.__current_player
 
     def dump_tree(self):
         print(repr(self))
@@ -125,24 +640,54 @@ class Node(object):
 
         return sorted(children, key=lambda c: c.visits)[-1]
 
-    def backprop(self):
-        winner = self.winner
-        current_node = self
+    def backprop(self, end_state=None, path=None, winner=None, values=None):
+        # end_state is the terminal state reached by a rollout below this node
+        # and path the nodes selected from the root down to this node (nodes
+        # shared through a transposition table have more than one parent).
+        # winner is given for nodes proven by the solver which are not
+        # terminal so update_misc is not called for them. values maps the
+        # players to the score an evaluator expects them to get from this
+        # node (1 for a win and 0.5 for a draw).
+        if path is None:
+            path = []
+            current_node = self
+            while current_node:
+                path.append(current_node)
+                current_node = current_node.parent
+        if values is not None:
+            for current_node in path:
+                current_node.visits += 1
+                for player, value in iteritems(values):
+                    current_node.wins_by_player[player] += value
+            return
+        if end_state is None:
+            end_state = self.state
+        proven = winner is not None
+        if not proven:
+            winner = self.game.get_winner(end_state)
         update_misc = None
-        if hasattr(self.game, 'update_misc'):
+        if not proven and hasattr(self.game, 'update_misc'):
             update_misc = self.game.update_misc
-        while current_node:
+        for current_node in path:
             current_node.visits += 1
             if winner is Draw:
                 current_node.draws += 1
             else:
                 current_node.wins_by_player[winner] += 1
             if update_misc:
-                update_misc(self.state, current_node.misc_by_player)
-            current_node = current_node.parent
+                update_misc(end_state, current_node.misc_by_player)
+
+    def promote(self, state):
+        """Detaches this node from its parent so it can be the root of the
+        next search from state, keeping the statistics of its subtree"""
+        self.parent = None
+        self.__state = state
+        self.__initial_state = deepcopy(state)
+        self.clear_cache()
 
     def reset_state(self):
         self.__state = None
+        self.clear_cache()
 
     def __repr__(self):
         return 'state=%r move=%r visits=%r wins=%r ucb=%r' % (
@@ -154,89 +699,1120 @@ class Node(object):
 
 
 class MCTS(object):
-    def __init__(self, game, initial_state=None, c=sqrt(2)):
+    def __init__(self, game, initial_state=None, c=sqrt(2), rollout=False,
+                 transpositions=None, seed=None, prefetch=None, solver=False,
+                 max_nodes=None, prune=False, profile=False,
+                 virtual_loss=1, evaluator=None, batch_size=1,
+                 widening=None, chance_widening=None):
+        # with profile every search times its phases and the game's
+        # callbacks in result.profile
+        self.profile = None
+        self.__unprofiled_game = game
+        if profile:
+            self.profile = Profile()
+            game = ProfiledGame(game, self.profile)
         self.game = game
         self.c = c
+        # seed is an int or a random.Random used for selection, rollouts and
+        # the game's determine (the global random module is used by default)
+        self.random = make_random(seed)
+        # in rollout mode only one node is added to the tree per iteration
+        # and the rest of the game is played out without creating nodes
+        self.rollout = rollout
+        # the maximum number of states kept in the transposition table
+        self.transpositions = transpositions
+        if transpositions:
+            if not hasattr(game, 'state_key'):
+                raise ValueError('Games need to implement state_key to use '
+                                 'a transposition table')
+            if hasattr(game, 'determine'):
+                raise ValueError('A transposition table cannot be used with '
+                                 'games that implement determine')
+        # the number of determinizations a background thread keeps ready for
+        # games that implement determine
+        self.prefetch = prefetch
+        # MCTS-Solver: positions whose outcome is proven are not searched
+        # any further and a search ends once the root is proven
+        self.solver = solver
+        if solver and hasattr(game, 'determine'):
+            raise ValueError('The solver cannot be used with games that '
+                             'implement determine')
+        # once the tree has max_nodes nodes it stops growing and iterations
+        # play out from the nodes they reach, or with prune the subtrees
+        # under the least visited nodes are dropped to make room
+        self.max_nodes = max_nodes
+        self.prune = prune
+        if prune and not max_nodes:
+            raise ValueError('Pruning needs a max_nodes budget')
+        if prune and transpositions:
+            raise ValueError('Trees with a transposition table cannot be '
+                             'pruned')
+        # the losses a thread adds to the nodes it is searching below so
+        # other threads searching the same tree look elsewhere
+        self.virtual_loss = virtual_loss
+        # evaluator(states) scores leaves instead of playing them out,
+        # batch_size leaves at a time (see evaluate_leaves)
+        self.evaluator = evaluator
+        self.batch_size = batch_size
+        if evaluator is not None and rollout:
+            raise ValueError('An evaluator replaces the rollouts of rollout '
+                             'mode')
+        # (k, alpha) pairs for progressive widening of the moves and double
+        # progressive widening of the outcomes of random moves: a node gets
+        # a new child once it has fewer than k * visits ** alpha
+        self.widening = widening
+        self.chance_widening = chance_widening
         if initial_state:
             self.__initial_state = initial_state
+        elif takes_random(game.initial_state):
+            self.__initial_state = game.initial_state(random=self.random)
         else:
             self.__initial_state = game.initial_state()
 
         self.__initial_state = deepcopy(self.__initial_state)
+        # the tree of the last search and the subtree promoted by advance
+        # that the next search continues from
+        self.__last_root = None
+        self.__root_node = None
+
+    def advance(self, move, state=None):
+        """Moves the root down to the child reached by playing move so the
+        next search continues from the statistics already gathered under it.
+
+        Call it once for every move applied since the last search (e.g. the
+        chosen move and the opponent's reply). state is the state after the
+        move and defaults to applying the move to the current state; games
+        with hidden information should pass the state as seen by the next
+        player to search. If the move was never explored the next search
+        starts from scratch."""
+        if state is None:
+            state = self.game.apply_move(self.__initial_state, move)
+        self.__initial_state = deepcopy(state)
+        root_node = self.__root_node or self.__last_root
+        child = root_node and root_node.get_child(move)
+        if child is not None:
+            child.promote(self.__initial_state)
+        self.__last_root = None
+        self.__root_node = child
 
     def get_simulation_result(self,
                               iterations=1,
                               actual_options=None,
                               get_leaf_nodes=False,
-                              max_seconds=None):
-        root_node = Node(game=self.game,
-                         parent=None,
-                         state=self.__initial_state,
-                         move=None,
-                         c=self.c)
-        MCTSResult = namedtuple('MCTSResult', 'root, move, leaf_nodes,'
-                                              'max_depth, avg_depth')
+                              max_seconds=None,
+                              processes=None,
+                              determinizations=None,
+                              early_stop=False,
+                              confidence=None,
+                              get_walks=False,
+                              walk_depth=None,
+                              threads=None):
+        """Searches and returns an MCTSResult with the most visited move.
+
+        get_walks counts the paths the iterations took as flamegraph walks
+        (cut off after walk_depth steps) in result.walks. Unlike
+        get_leaf_nodes this takes memory for every distinct walk instead of
+        for every iteration and works with processes.
+
+        early_stop stops the search once the most visited move cannot be
+        overtaken in the iterations left. confidence stops it once the
+        win rate of the most visited move is better than the win rate of
+        every other move by confidence standard deviations (3 is a good
+        start).
+
+        threads searches one tree with that many threads (see search)."""
+        if processes is not None and processes > 1:
+            if threads is not None and threads > 1:
+                raise ValueError('A search runs in either processes or '
+                                 'threads')
+            if early_stop or confidence:
+                raise ValueError('Parallel searches cannot stop early')
+            return self.get_parallel_simulation_result(processes,
+                                                       iterations,
+                                                       actual_options,
+                                                       get_leaf_nodes,
+                                                       max_seconds,
+                                                       determinizations,
+                                                       get_walks,
+                                                       walk_depth)
         if max_seconds:
-            iterations = float('inf')
+            iterations = None
+        search = self.search(iterations,
+                             max_seconds=max_seconds,
+                             actual_options=actual_options,
+                             get_leaf_nodes=get_leaf_nodes,
+                             determinizations=determinizations,
+                             early_stop=early_stop,
+                             confidence=confidence,
+                             get_walks=get_walks,
+                             walk_depth=walk_depth,
+                             threads=threads)
+        with search:
+            search.run()
+        return search.result()
+
+    def search(self,
+               iterations=None,
+               max_seconds=None,
+               actual_options=None,
+               get_leaf_nodes=False,
+               determinizations=None,
+               early_stop=False,
+               confidence=None,
+               get_walks=False,
+               walk_depth=None,
+               threads=None):
+        """Starts a search that runs as its Search is run or iterated over
+        for snapshots. Without iterations or max_seconds it runs until it
+        is cancelled. See get_simulation_result for stopping early.
+
+        With threads the search is run by that many threads selecting and
+        backpropagating in one tree under a lock and playing out outside
+        of it. Needs rollout mode. Threads only play out at the same time
+        without a GIL or when the game's callbacks release it, which games
+        say with a releases_gil = True attribute. Otherwise the search runs
+        in the calling thread like a search without threads."""
+        if threads is not None and threads > 1:
+            if not self.rollout:
+                raise ValueError('Threads need rollout mode to play out '
+                                 'outside of the tree')
+            if hasattr(self.game, 'determine'):
+                raise ValueError('Threads cannot share a tree with games '
+                                 'that implement determine')
+            if self.profile is not None:
+                raise ValueError('Searches with threads cannot be profiled')
+        if self.profile is not None:
+            self.profile.reset()
+        root_node = self.__root_node
+        if root_node is None:
+            root_node = self.new_root()
+        elif root_node.budget is not None:
+            # the budget counted the whole tree the subtree was kept from
+            root_node.budget.nodes = tree_size(root_node)
+        self.__last_root = root_node
+        self.__root_node = None
+        return Search(self, root_node,
+                      iterations=iterations,
+                      max_seconds=max_seconds,
+                      actual_options=actual_options,
+                      get_leaf_nodes=get_leaf_nodes,
+                      determinations=self.determinations(determinizations),
+                      early_stop=early_stop,
+                      confidence=confidence,
+                      get_walks=get_walks,
+                      walk_depth=walk_depth,
+                      threads=threads)
+
+    def iterate(self, root_node, determinations=None):
+        """Runs search iterations from root_node until the generator is
+        closed, yielding the path of nodes every iteration selected from the
+        root and the depth of the game it played. determinations is an
+        iterator over the states the root is determined with before every
+        iteration."""
+        determined = hasattr(self.game, 'determine')
+        budget = root_node.budget
+        # lap(phase) adds the time since the last lap to phase
+        lap = _no_lap
+        if self.profile is not None:
+            lap = self.profile.lap
+        while True:
+            lap()
+            if budget is not None and budget.full and self.prune:
+                prune(root_node, budget.max_nodes // 2)
+                lap('prune')
+            if determinations is not None:
+                root_node.determine(next(determinations))
+                lap('determine')
+            current_node = root_node
+            path = [root_node]
+            if self.rollout:
+                path = self.select(root_node, determined)
+                current_node = path[-1]
+                lap('select')
+                if current_node.proven is not None:
+                    rollout_depth = 0
+                    current_node.backprop(path=path,
+                                          winner=current_node.proven)
+                else:
+                    end_state, rollout_depth = play_out(self.game,
+                                                        current_node.state,
+                                                        self.random)
+                    lap('rollout')
+                    current_node.backprop(end_state, path)
+                depth = len(path) - 1 + rollout_depth
+            else:
+                end_state = None
+                rollout_depth = 0
+                tree_full = False
+                while (current_node.winner is None and
+                       current_node.proven is None):
+                    if (budget is not None and budget.full and
+                            not current_node.expanded_children):
+                        tree_full = True
+                        break
+                    if not current_node.get_moves()[1]:
+                        raise ValueError(NO_WINNER_MESSAGE)
+                    current_node = current_node.get_best_child()
+                    path.append(current_node)
+                    if determined:
+                        current_node.reset_state()
+                lap('select')
+                if tree_full:
+                    # play the rest of the game out without adding nodes
+                    end_state, rollout_depth = play_out(
+                        self.game, current_node.state, self.random)
+                    lap('rollout')
+                if current_node.proven is not None:
+                    current_node.backprop(path=path,
+                                          winner=current_node.proven)
+                else:
+                    current_node.backprop(end_state, path)
+                depth = len(path) - 1 + rollout_depth
+            lap('backprop')
+            if self.solver:
+                prove_path(path)
+                lap('prove')
+            yield path, depth
+
+    def evaluate_leaves(self, root_node, determinations=None):
+        """Runs search iterations like iterate, except that every iteration
+        stops at the first node that has not been evaluated yet and scores
+        it with evaluator instead of playing it out.
+
+        evaluator(states) returns a (values, priors) tuple for every state:
+        values maps every player to the score they are expected to get (1
+        for a win and 0.5 for a draw) and priors maps the moves to the
+        probabilities children are selected with (PUCT), or is None to
+        select children with UCB1. The leaves of batch_size iterations are
+        evaluated at once: the nodes above leaves waiting for evaluation
+        get virtual losses so the iterations of a batch spread out. A batch
+        is evaluated early when an iteration selects a leaf already waiting
+        for evaluation. Terminal and proven leaves are not evaluated."""
+        determined = hasattr(self.game, 'determine')
+        budget = root_node.budget
+        virtual_loss = 0
+        if self.batch_size > 1:
+            virtual_loss = self.virtual_loss
+        lap = _no_lap
+        if self.profile is not None:
+            lap = self.profile.lap
+        # (path, state) of the leaves waiting for evaluation
+        pending = []
+        try:
+            while True:
+                lap()
+                if budget is not None and budget.full and self.prune:
+                    prune(root_node, budget.max_nodes // 2)
+                    lap('prune')
+                if determinations is not None:
+                    root_node.determine(next(determinations))
+                    lap('determine')
+                path = self.select_leaf(root_node, determined, virtual_loss)
+                leaf = path[-1]
+                lap('select')
+                if leaf.winner is not None or leaf.proven is not None:
+                    remove_virtual_loss(path, virtual_loss)
+                    if leaf.proven is not None:
+                        leaf.backprop(path=path, winner=leaf.proven)
+                    else:
+                        leaf.backprop(path=path)
+                    lap('backprop')
+                    if self.solver:
+                        prove_path(path)
+                        lap('prove')
+                    yield path, len(path) - 1
+                    continue
+                if any(leaf is other[-1] for other, _ in pending):
+                    # this iteration is dropped and the batch evaluated
+                    remove_virtual_loss(path, virtual_loss)
+                else:
+                    pending.append((path, leaf.state))
+                    if len(pending) < self.batch_size:
+                        continue
+                evaluations = list(
+                    self.evaluator([state for _, state in pending]))
+                lap('evaluate')
+                for (path, _), (values, priors) in zip(pending, evaluations):
+                    if path[-1].priors is None:
+                        path[-1].priors = priors or {}
+                while pending:
+                    path, _ = pending.pop(0)
+                    values, _ = evaluations.pop(0)
+                    remove_virtual_loss(path, virtual_loss)
+                    path[-1].backprop(path=path, values=values)
+                    lap('backprop')
+                    yield path, len(path) - 1
+        finally:
+            for path, _ in pending:
+                remove_virtual_loss(path, virtual_loss)
+
+    def select_leaf(self, root_node, determined=False, virtual_loss=0):
+        """Returns the path of nodes selected from root_node down to the
+        first node that has not been evaluated yet (or a terminal or proven
+        node, or a node the budget keeps from being expanded), adding
+        virtual_loss to the virtual visits of the nodes on the way"""
+        budget = root_node.budget
+        current_node = root_node
+        path = [root_node]
+        root_node.virtual_visits += virtual_loss
+        while (current_node.winner is None and
+               current_node.proven is None and
+               current_node.priors is not None):
+            if (budget is not None and budget.full and
+                    not current_node.expanded_children):
+                # the tree is full: the node is evaluated again
+                break
+            if not current_node.get_moves()[1]:
+                raise ValueError(NO_WINNER_MESSAGE)
+            current_node = current_node.get_best_child()
+            path.append(current_node)
+            current_node.virtual_visits += virtual_loss
+            if determined:
+                current_node.reset_state()
+        return path
+
+    def select(self, root_node, determined=False, virtual_loss=0):
+        """Returns the path of nodes selected from root_node in rollout mode,
+        ending at the node added to the tree (or at a terminal or proven
+        node or the node the budget stopped at). determined resets the
+        states of the nodes on the way for the root's determination.
+        virtual_loss is added to the virtual visits of the nodes on the
+        path."""
+        current_node = root_node
+        path = [root_node]
+        root_node.virtual_visits += virtual_loss
+        while current_node.winner is None and current_node.proven is None:
+            child, expanded = current_node.expand_one()
+            if child is None:
+                break
+            current_node = child
+            path.append(current_node)
+            current_node.virtual_visits += virtual_loss
+            if determined:
+                current_node.reset_state()
+            if expanded:
+                break
+        return path
+
+    def get_parallel_simulation_result(self,
+                                       processes,
+                                       iterations=1,
+                                       actual_options=None,
+                                       get_leaf_nodes=False,
+                                       max_seconds=None,
+                                       determinizations=None,
+                                       get_walks=False,
+                                       walk_depth=None):
+        """Root parallelization: runs independent searches from the initial
+        state in a pool of processes and merges the statistics of the
+        children of their roots before picking the most visited move.
+
+        The iterations are split between the processes so the merged root
+        has the same number of visits as a serial search. max_seconds is
+        the time budget of every process. Only the root and its children
+        are returned in the merged tree and a subtree kept by advance is not
+        searched further.
+
+        For games that implement determine, determinizations samples that
+        many determinizations in total up front (each process samples its
+        share) which the processes then cycle through instead of calling
+        determine on every iteration. The walks recorded by the processes
+        with get_walks are added up."""
+        if get_leaf_nodes:
+            raise ValueError('Leaf nodes cannot be collected from searches '
+                             'run in other processes')
+        if max_seconds:
+            budgets = [None] * processes
+        else:
+            budgets = [budget for budget in _split(iterations, processes)
+                       if budget]
+        if determinizations:
+            shares = _split(max(determinizations, len(budgets)),
+                            len(budgets))
+        else:
+            shares = [None] * len(budgets)
+        pool = _process_pool(len(budgets), _init_worker,
+                             (self.__unprofiled_game, self.__initial_state,
+                              {'c': self.c,
+                               'rollout': self.rollout,
+                               'transpositions': self.transpositions,
+                               'prefetch': self.prefetch,
+                               'solver': self.solver,
+                               'max_nodes': self.max_nodes,
+                               'prune': self.prune,
+                               'profile': self.profile is not None,
+                               'virtual_loss': self.virtual_loss,
+                               'evaluator': self.evaluator,
+                               'batch_size': self.batch_size,
+                               'widening': self.widening,
+                               'chance_widening': self.chance_widening}))
+        try:
+            # every process searches with its own stream of random numbers
+            seeds = [self.random.getrandbits(64) for _ in budgets]
+            walks = (get_walks, walk_depth)
+            summaries = pool.map(_search_worker,
+                                 list(zip(budgets,
+                                          [max_seconds] * len(budgets),
+                                          shares,
+                                          seeds,
+                                          [walks] * len(budgets))))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        root_node = self.new_root()
         plays = 0
         max_depth = 0
         total_depth = 0
-        leaf_nodes = []
-        determined = hasattr(self.game, 'determine')
-        start_time = time()
-        while plays < iterations:
-            if max_seconds is not None and time() - start_time > max_seconds:
-                break
-            root_node.determine()
-            current_node = root_node
-            while current_node.winner is None and current_node.children:
-                current_node = current_node.get_best_child()
-                if determined:
-                    current_node.reset_state()
-            if current_node.winner is None:
-                raise ValueError('A game cannot have a terminal node that '
-                                 'has no winner. If the game was a draw '
-                                 'return Draw')
-            current_node.backprop()
-            max_depth = max(max_depth, current_node.depth)
-            total_depth += current_node.depth
-            plays += 1
-            if get_leaf_nodes:
-                    leaf_nodes.append(current_node)
+        walks = Counter() if get_walks else None
+        profile = Profile() if self.profile is not None else None
+        for summary in summaries:
+            plays += summary['plays']
+            if walks is not None:
+                walks.update(summary['walks'])
+            if profile is not None:
+                profile.merge(summary['profile'])
+            max_depth = max(max_depth, summary['max_depth'])
+            total_depth += summary['total_depth']
+            _merge_stats(root_node, summary['root'])
+            for move, stats in summary['children']:
+                root_node.add_new_children_for_determination([move])
+                _merge_stats(root_node.get_child(move), stats)
+        self.__last_root = root_node
+        self.__root_node = None
 
         move = root_node.most_visited_child(actual_options).move
         return MCTSResult(root=root_node,
                           move=move,
-                          leaf_nodes=leaf_nodes,
+                          leaf_nodes=[],
                           avg_depth=float(total_depth) / plays,
-                          max_depth=max_depth)
+                          max_depth=max_depth,
+                          walks=walks,
+                          profile=profile)
 
+    def new_root(self):
+        transpositions = None
+        if self.transpositions:
+            transpositions = TranspositionTable(self.transpositions)
+        return Node(game=self.game,
+                    parent=None,
+                    state=self.__initial_state,
+                    move=None,
+                    c=self.c,
+                    transpositions=transpositions,
+                    random=self.random,
+                    solver=self.solver,
+                    budget=self.max_nodes and NodeBudget(self.max_nodes),
+                    widening=self.widening,
+                    chance_widening=self.chance_widening)
 
-def flamegraph(mcts_result, depth=None):
-    root_node = mcts_result.root
-    leaf_nodes = mcts_result.leaf_nodes
-    walks = Counter()
-    current_player = root_node.current_player
-    for node in leaf_nodes:
-        moves = []
-        while node:
-            extra = ''
-            if node == root_node:
+    def determinization_sampler(self, random=None):
+        """Returns a function drawing determinizations of the initial state.
+        Games can prepare what every determinization shares once per search
+        by implementing determinization_sampler(state), which returns such
+        a function, instead of having determine called every time."""
+        if random is None:
+            random = self.random
+        return determinization_sampler(self.game, self.__initial_state,
+                                       random)
+
+    def sample_determinizations(self, count):
+        """Samples count determinizations of the initial state up front"""
+        if not hasattr(self.game, 'determine'):
+            raise ValueError('Only games that implement determine can be '
+                             'searched with determinizations')
+        sampler = self.determinization_sampler()
+        return [sampler() for _ in range(count)]
+
+    def determinations(self, determinizations=None):
+        """Returns an iterator over the determinizations the root of a search
+        is determined with (None for games without determine): a cycle
+        through determinizations samples drawn up front, a queue filled by
+        a background thread if the search prefetches determinizations or
+        else a new determinization for every iteration"""
+        if determinizations:
+            return cycle(self.sample_determinizations(determinizations))
+        if not hasattr(self.game, 'determine'):
+            return None
+        if self.prefetch:
+            # the thread draws from its own generator so the sequence of
+            # determinizations does not depend on thread scheduling
+            sampler = self.determinization_sampler(
+                Random(self.random.getrandbits(64)))
+            return DeterminizationQueue(sampler, self.prefetch)
+        return _draw(self.determinization_sampler())
+
+
+class Search(object):
+    """A search in progress. run() runs (part of) it and snapshots()
+    iterates over snapshots of it while it runs, so a search can be shown
+    while it thinks, stopped with cancel() once the best move is settled or
+    given more time with extend(). Close it (or use it as a context
+    manager) once done to stop any determinization prefetching."""
+
+    def __init__(self, mcts, root_node, iterations=None, max_seconds=None,
+                 actual_options=None, get_leaf_nodes=False,
+                 determinations=None, early_stop=False, confidence=None,
+                 get_walks=False, walk_depth=None, threads=None):
+        self.mcts = mcts
+        self.root = root_node
+        self.iterations = iterations
+        self.max_seconds = max_seconds
+        self.actual_options = actual_options
+        self.get_leaf_nodes = get_leaf_nodes
+        self.determinations = determinations
+        self.early_stop = early_stop
+        self.confidence = confidence
+        self.settled = False
+        self.plays = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.leaf_nodes = []
+        self.walks = None
+        if get_walks:
+            self.walks = WalkRecorder(root_node, walk_depth)
+        self.cancelled = False
+        self.threads = threads
+        self.start_time = time()
+        iterate = mcts.iterate
+        if mcts.evaluator is not None:
+            iterate = mcts.evaluate_leaves
+        self.__iterations = iterate(root_node, determinations)
+
+    @property
+    def seconds(self):
+        return time() - self.start_time
+
+    @property
+    def done(self):
+        return (self.cancelled or self.settled or self.solved or
+                (self.iterations is not None and
+                 self.plays >= self.iterations) or
+                (self.max_seconds is not None and
+                 self.seconds > self.max_seconds))
+
+    @property
+    def solved(self):
+        return self.root.proven is not None
+
+    def run(self, iterations=None, seconds=None):
+        """Runs at most iterations more iterations for at most seconds (by
+        default until the search is done) and returns how many ran"""
+        stop = float('inf')
+        if self.iterations is not None:
+            stop = self.iterations
+        if iterations is not None:
+            stop = min(stop, self.plays + iterations)
+        deadline = None
+        if self.max_seconds is not None:
+            deadline = self.start_time + self.max_seconds
+        if seconds is not None:
+            deadline = min(deadline or float('inf'), time() + seconds)
+        plays = start = self.plays
+        check_every = None
+        if self.early_stop or self.confidence:
+            check_every = EARLY_STOP_CHECK_EVERY
+        if self.cancelled or self.settled or self.solved or plays >= stop or (
+                deadline is not None and time() > deadline):
+            return 0
+        if (self.threads is not None and self.threads > 1 and
+                threads_run_in_parallel(self.mcts.game)):
+            return self.run_threads(stop, deadline, check_every)
+        max_depth = self.max_depth
+        total_depth = self.total_depth
+        leaf_nodes = self.leaf_nodes if self.get_leaf_nodes else None
+        walks = self.walks
+        root = self.root
+        try:
+            for path, depth in self.__iterations:
+                if depth > max_depth:
+                    max_depth = depth
+                total_depth += depth
+                plays += 1
+                if leaf_nodes is not None:
+                    leaf_nodes.append(path[-1])
+                if walks is not None:
+                    walks.record(path)
+                if plays >= stop or self.cancelled:
+                    break
+                if root.proven is not None:
+                    break
+                if check_every and not plays % check_every:
+                    self.plays = plays
+                    if self.is_settled():
+                        self.settled = True
+                        break
+                if deadline is not None and time() > deadline:
+                    break
+        finally:
+            self.plays = plays
+            self.max_depth = max_depth
+            self.total_depth = total_depth
+        return plays - start
+
+    def run_threads(self, stop, deadline, check_every):
+        """Runs iterations in self.threads threads sharing the tree until
+        stop iterations have started or the deadline passes"""
+        mcts = self.mcts
+        root = self.root
+        budget = root.budget
+        virtual_loss = mcts.virtual_loss
+        lock = Lock()
+        start = self.plays
+        # the iterations started (self.plays counts the finished ones)
+        started = [start]
+        errors = []
+
+        def stopping():
+            return (errors or started[0] >= stop or self.cancelled or
+                    self.settled or root.proven is not None or
+                    (deadline is not None and time() > deadline))
+
+        def search(random):
+            try:
+                while True:
+                    with lock:
+                        if stopping():
+                            return
+                        started[0] += 1
+                        if budget is not None and budget.full and mcts.prune:
+                            prune(root, budget.max_nodes // 2)
+                        path = mcts.select(root, virtual_loss=virtual_loss)
+                        node = path[-1]
+                        proven = node.proven
+                        state = node.state
+                    rollout_depth = 0
+                    if proven is None:
+                        state, rollout_depth = play_out(mcts.game, state,
+                                                        random)
+                    with lock:
+                        remove_virtual_loss(path, virtual_loss)
+                        if proven is not None:
+                            node.backprop(path=path, winner=proven)
+                        else:
+                            node.backprop(state, path)
+                        if mcts.solver:
+                            prove_path(path)
+                        self.record(path, len(path) - 1 + rollout_depth)
+                        if (check_every and not self.plays % check_every and
+                                self.is_settled()):
+                            self.settled = True
+            except Exception as error:
+                with lock:
+                    errors.append(error)
+
+        threads = [Thread(target=search,
+                          args=(Random(mcts.random.getrandbits(64)),))
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return self.plays - start
+
+    def record(self, path, depth):
+        self.plays += 1
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        if self.get_leaf_nodes:
+            self.leaf_nodes.append(path[-1])
+        if self.walks is not None:
+            self.walks.record(path)
+
+    def is_settled(self):
+        """Whether the search stopping early would not change its move"""
+        children = [child for child in self.root.expanded_children
+                    if (not self.actual_options or
+                        child.move in self.actual_options)]
+        if len(children) < 2:
+            return False
+        children.sort(key=lambda child: child.visits, reverse=True)
+        leader = children[0]
+        if self.early_stop and self.iterations is not None:
+            # every iteration visits one child so the lead shrinks by at
+            # most one per iteration
+            iterations_left = self.iterations - self.plays
+            if leader.visits - children[1].visits > iterations_left:
+                return True
+        if self.confidence and all(child.visits for child in children):
+            player = self.root.current_player
+
+            def bound(child):
+                # a win rate's standard deviation is at most 0.5 / sqrt(n)
+                return self.confidence * 0.5 / sqrt(child.visits)
+            lower = win_rate(leader, player) - bound(leader)
+            if all(win_rate(child, player) + bound(child) < lower
+                   for child in children[1:]):
+                return True
+        return False
+
+    def snapshots(self, every=None, every_seconds=None):
+        """Runs the search, yielding a Snapshot every `every` iterations
+        and/or every every_seconds seconds until it is done"""
+        if every is None and every_seconds is None:
+            raise ValueError('Snapshots need to be taken every so many '
+                             'iterations or seconds')
+        while not self.done:
+            self.run(every, every_seconds)
+            yield self.snapshot()
+
+    def snapshot(self):
+        player = self.root.current_player
+        children = [child for child in self.root.expanded_children
+                    if child.visits and (not self.actual_options or
+                                         child.move in self.actual_options)]
+        children.sort(key=lambda child: child.visits, reverse=True)
+        seconds = self.seconds
+        return Snapshot(
+            iterations=self.plays,
+            seconds=seconds,
+            iterations_per_second=seconds and self.plays / seconds,
+            move=children[0].move if children else None,
+            children=[MoveStats(move=child.move,
+                                visits=child.visits,
+                                win_rate=win_rate(child, player))
+                      for child in children],
+            done=self.done)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def extend(self, iterations=None, seconds=None):
+        """Adds to the iteration and time budgets of the search. A search
+        can only be extended by a budget it was started with."""
+        if iterations is not None and self.iterations is None:
+            raise ValueError('The search has no iteration budget to extend')
+        if seconds is not None and self.max_seconds is None:
+            raise ValueError('The search has no time budget to extend')
+        self.settled = False
+        if iterations is not None and self.iterations is not None:
+            self.iterations += iterations
+        if seconds is not None and self.max_seconds is not None:
+            self.max_seconds += seconds
+
+    def result(self):
+        if self.mcts.solver:
+            move = self.root.best_solved_child(self.actual_options).move
+        else:
+            move = self.root.most_visited_child(self.actual_options).move
+        iterations_saved = 0
+        if (self.settled or self.solved) and self.iterations is not None:
+            iterations_saved = self.iterations - self.plays
+        # a root proven before the search started is not searched at all
+        avg_depth = self.plays and float(self.total_depth) / self.plays
+        profile = None
+        if self.mcts.profile is not None:
+            profile = self.mcts.profile.copy()
+        return MCTSResult(root=self.root,
+                          move=move,
+                          leaf_nodes=self.leaf_nodes,
+                          avg_depth=avg_depth,
+                          walks=self.walks.walks if self.walks else None,
+                          profile=profile,
+                          max_depth=self.max_depth,
+                          iterations_saved=iterations_saved)
+
+    def close(self):
+        self.__iterations.close()
+        if hasattr(self.determinations, 'close'):
+            self.determinations.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NodeBudget(object):
+    """Counts the nodes of a tree against a maximum"""
+
+    def __init__(self, max_nodes, nodes=1):
+        self.max_nodes = max_nodes
+        self.nodes = nodes
+
+    @property
+    def full(self):
+        return self.nodes >= self.max_nodes
+
+
+def tree_size(node):
+    """The number of nodes under and including node (nodes shared through a
+    transposition table are counted once)"""
+    seen = set()
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            nodes.extend(node.expanded_children)
+    return len(seen)
+
+
+def prune(root_node, max_nodes):
+    """Drops the subtrees under the least visited nodes (never the root or
+    its children) until the tree has at most max_nodes nodes"""
+    expanded = []
+    nodes = list(root_node.expanded_children)
+    while nodes:
+        node = nodes.pop()
+        children = node.expanded_children
+        if children:
+            expanded.append(node)
+            nodes.extend(children)
+    # a node has at least as many visits as any node under it so subtrees
+    # are dropped bottom up
+    expanded.sort(key=lambda node: (node.visits, -node.depth))
+    budget = root_node.budget
+    for node in expanded:
+        if budget.nodes <= max_nodes:
+            break
+        budget.nodes -= node.prune()
+
+
+def win_rate(node, player):
+    return ((node.wins_by_player.get(player, 0) + node.draws * 0.5) /
+            float(node.visits))
+
+
+def determinization_sampler(game, state, random):
+    sampler = getattr(game, 'determinization_sampler', None)
+    if sampler is None:
+        return partial(determine, game, state, random)
+    if takes_random(sampler):
+        return sampler(state, random=random)
+    return sampler(state)
+
+
+def _draw(sampler):
+    while True:
+        yield sampler()
+
+
+class DeterminizationQueue(object):
+    """Draws determinizations from sampler in a background thread, keeping
+    up to size of them ready in batches of batch_size. Close it to stop the
+    thread. Sampling only overlaps with the search where the game's code
+    releases the GIL so this mostly pays off for games whose determine
+    waits on something else (a solver, I/O, a C extension)."""
+
+    def __init__(self, sampler, size, batch_size=16):
+        self.sampler = sampler
+        self.batch_size = max(1, min(batch_size, size))
+        self.batches = Queue(max(1, size // self.batch_size))
+        self.batch = []
+        self.stopped = Event()
+        self.thread = Thread(target=self.fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def fill(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.sampler() for _ in range(self.batch_size)]
+            except Exception as e:
+                batch = e
+            while not self.stopped.is_set():
+                try:
+                    self.batches.put(batch, timeout=0.1)
+                    break
+                except Full:
+                    pass
+            if isinstance(batch, Exception):
+                return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.batch:
+            batch = self.batches.get()
+            if isinstance(batch, Exception):
+                raise batch
+            self.batch = batch[::-1]
+        return self.batch.pop()
+
+    next = __next__
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def widening_limit(widening, visits):
+    """The number of children progressive widening allows a node with
+    visits visits (always at least one)"""
+    k, alpha = widening
+    return max(1, int(k * visits ** alpha))
+
+
+def remove_virtual_loss(path, virtual_loss):
+    for node in path:
+        node.virtual_visits -= virtual_loss
+
+
+def gil_enabled():
+    """Whether the interpreter runs Python code in one thread at a time"""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+
+def threads_run_in_parallel(game):
+    """Whether threads searching game can play out at the same time: without
+    a GIL or when the game's callbacks release it (releases_gil = True)"""
+    return not gil_enabled() or getattr(game, 'releases_gil', False)
+
+
+def prove_path(path):
+    """Proves the nodes of path from the bottom up for the solver, stopping
+    at the first node that cannot be proven yet"""
+    for node in reversed(path):
+        if not node.prove():
+            break
+
+
+def play_out(game, state, random=None):
+    """Plays state out to the end of the game without creating any nodes
+    and returns the terminal state and the number of moves played.
+
+    Moves are picked at random unless the game defines a
+    rollout_policy(state, moves) classmethod. Random moves are always
+    picked at random."""
+    if random is None:
+        random = global_random
+    rollout_policy = getattr(game, 'rollout_policy', None)
+    if rollout_policy is not None and takes_random(rollout_policy):
+        rollout_policy = partial(rollout_policy, random=random)
+    depth = 0
+    while game.get_winner(state) is None:
+        is_random, moves = game.get_moves(state)
+        if not moves:
+            raise ValueError(NO_WINNER_MESSAGE)
+        if rollout_policy is not None and not is_random:
+            move = rollout_policy(state, moves)
+        else:
+            move = random.choice(moves)
+        state = game.apply_move(state, move)
+        depth += 1
+    return state, depth
+
+
+def _split(total, parts):
+    return [total // parts + (part < total % parts and 1 or 0)
+            for part in range(parts)]
+
+
+def _node_stats(node):
+    return node.visits, node.draws, dict(node.wins_by_player)
+
+
+def _merge_stats(node, stats):
+    visits, draws, wins_by_player = stats
+    node.visits += visits
+    node.draws += draws
+    for player, wins in iteritems(wins_by_player):
+        node.wins_by_player[player] += wins
+
+
+def _process_pool(processes, initializer=None, initargs=(),
+                  maxtasksperchild=None):
+    # forking lets workers inherit the game and initial state so they do
+    # not need to be picklable
+    try:
+        context = multiprocessing.get_context('fork')
+    except (AttributeError, ValueError):
+        context = multiprocessing
+    return context.Pool(processes, initializer, initargs, maxtasksperchild)
+
+
+_worker_mcts = None
+
+
+def _init_worker(game, initial_state, options):
+    global _worker_mcts
+    _worker_mcts = MCTS(game, initial_state, **options)
+
+
+def _search_worker(budget):
+    iterations, max_seconds, determinizations, seed, walks = budget
+    get_walks, walk_depth = walks
+    _worker_mcts.random = Random(seed)
+    # games that use the global random module get their own stream too
+    global_random.seed(seed)
+    result = _worker_mcts.get_simulation_result(
+        iterations or 1,
+        max_seconds=max_seconds,
+        determinizations=determinizations,
+        get_walks=get_walks,
+        walk_depth=walk_depth)
+    plays = result.root.visits
+    return {'plays': plays,
+            'walks': result.walks,
+            'profile': result.profile,
+            'max_depth': result.max_depth,
+            'total_depth': result.avg_depth * plays,
+            'root': _node_stats(result.root),
+            'children': [(child.move, _node_stats(child))
+                         for child in result.root.expanded_children]}
+
+
+class WalkRecorder(object):
+    """Counts the paths iterations take from the root as the walks of a
+    flamegraph: the moves (suffixed with -opp for moves of the other
+    players) followed by the result of the game if it ended in the tree,
+    cut off after depth steps"""
+
+    def __init__(self, root_node, depth=None):
+        self.player = root_node.current_player
+        self.depth = depth
+        self.walks = Counter()
+
+    def record(self, path):
+        player = self.player
+        depth = self.depth
+        walk = []
+        parent = path[0]
+        for node in path[1:]:
+            if depth is not None and len(walk) >= depth:
                 break
-            else:
-                move = node.move
-            if node.parent.current_player != current_player:
-                extra = '-opp'
-            if node.winner == Draw:
-                moves.insert(0, '{}-draw'.format(current_player))
-            elif node.winner == current_player:
-                moves.insert(0, '{}-win'.format(current_player))
-            elif node.winner is not None:
-                moves.insert(0, '{}-lose'.format(current_player))
-            moves.insert(0, str(move) + extra)
-            node = node.parent
+            move = str(node.move)
+            if parent.current_player != player:
+                move += '-opp'
+            walk.append(move)
+            winner = node.winner
+            if winner is Draw:
+                walk.append('{}-draw'.format(player))
+            elif winner == player:
+                walk.append('{}-win'.format(player))
+            elif winner is not None:
+                walk.append('{}-lose'.format(player))
+            parent = node
         if depth is not None:
-            moves = moves[:depth]
-        walks[';'.join(moves)] += 1
-    for path, count in walks.iteritems():
-        print('{} {}'.format(path, count))
+            walk = walk[:depth]
+        self.walks[';'.join(walk)] += 1
+
+
+def flamegraph(mcts_result, depth=None):
+    """Prints the walks of a search run with get_walks (or get_leaf_nodes)
+    in the folded format read by flamegraph.pl"""
+    walks = mcts_result.walks
+    if walks is None:
+        root_node = mcts_result.root
+        recorder = WalkRecorder(root_node, depth)
+        for node in mcts_result.leaf_nodes:
+            path = [node]
+            while node is not root_node and node.parent:
+                node = node.parent
+                path.append(node)
+            recorder.record(path[::-1])
+        walks = recorder.walks
+    elif depth is not None:
+        walks_to_depth = Counter()
+        for walk, count in iteritems(walks):
+            walks_to_depth[';'.join(walk.split(';')[:depth])] += count
+        walks = walks_to_depth
+    for walk, count in iteritems(walks):
+        print('{} {}'.format(walk, count))
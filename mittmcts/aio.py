@@ -0,0 +1,68 @@
+"""Runs searches from asyncio code without blocking the event loop.
+
+The search runs in slices of a few iterations and the event loop gets to
+run its other tasks between slices, so one process can search for many
+games while it keeps serving connections. Requires Python 3.5 or later."""
+
+import asyncio
+
+
+async def run(search, slice_iterations=100, slice_seconds=0.01,
+              executor=None):
+    """Runs a Search until it is done and returns its MCTSResult. Every
+    slice runs at most slice_iterations iterations for at most
+    slice_seconds, either in the event loop's thread or in executor (a
+    concurrent.futures.ThreadPoolExecutor). Cancelling the task running
+    this coroutine cancels the search. The search is closed once it is
+    over."""
+    slice_future = None
+    try:
+        while not search.done:
+            if executor is None:
+                search.run(slice_iterations, slice_seconds)
+                await asyncio.sleep(0)
+            else:
+                slice_future = executor.submit(search.run, slice_iterations,
+                                               slice_seconds)
+                await asyncio.wrap_future(slice_future)
+                slice_future = None
+        return search.result()
+    except asyncio.CancelledError:
+        search.cancel()
+        raise
+    finally:
+        if slice_future is not None and not slice_future.done():
+            # the slice stops at its next iteration now that the search is
+            # cancelled and the search can only be closed after that
+            slice_future.add_done_callback(lambda _: search.close())
+        else:
+            search.close()
+
+
+async def get_simulation_result(mcts,
+                                iterations=1,
+                                actual_options=None,
+                                get_leaf_nodes=False,
+                                max_seconds=None,
+                                determinizations=None,
+                                early_stop=False,
+                                confidence=None,
+                                get_walks=False,
+                                walk_depth=None,
+                                slice_iterations=100,
+                                slice_seconds=0.01,
+                                executor=None):
+    """The coroutine version of MCTS.get_simulation_result. max_seconds is
+    a wall-clock deadline: the best move found by then is returned."""
+    if max_seconds:
+        iterations = None
+    search = mcts.search(iterations,
+                         max_seconds=max_seconds,
+                         actual_options=actual_options,
+                         get_leaf_nodes=get_leaf_nodes,
+                         determinizations=determinizations,
+                         early_stop=early_stop,
+                         confidence=confidence,
+                         get_walks=get_walks,
+                         walk_depth=walk_depth)
+    return await run(search, slice_iterations, slice_seconds, executor)
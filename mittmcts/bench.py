@@ -0,0 +1,265 @@
+"""Benchmarks the search engines on the games bundled with the tests.
+
+Run from the root of the repository (the games live in the test package):
+
+    python -m mittmcts.bench --json bench.json
+
+Every benchmark runs in its own process so the peak RSS is its own.
+--determinizations compares the Euchre determinizations per second of
+EuchreGame.determine with the python-constraint solver it replaced.
+--threads measures how a rollout search of one tree scales with 1, 2, 4
+and 8 threads. The games are run as if they released the GIL so the
+threads are used even with a GIL, where they only take turns."""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import json
+import platform
+import random
+import sys
+from time import time
+
+from mittmcts import MCTS, _process_pool, gil_enabled, tree_size
+from mittmcts.compact import CompactMCTS
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def tictactoe():
+    from test.games import TicTacToeGame
+    return TicTacToeGame, TicTacToeGame.initial_state()
+
+
+def connect4():
+    from test.connect4 import ConnectFourGame
+    return ConnectFourGame, ConnectFourGame.initial_state()
+
+
+def euchre():
+    from test.euchre import EuchreGame
+    return EuchreGame, EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'],
+                                                'jd')
+
+
+def dice():
+    from test.games import SimpleDiceRollingGame
+    return SimpleDiceRollingGame, SimpleDiceRollingGame.initial_state()
+
+
+# game name -> (function returning the game and its initial state,
+#               default number of iterations)
+GAMES = OrderedDict([
+    ('tictactoe', (tictactoe, 2000)),
+    ('connect4', (connect4, 1000)),
+    ('euchre', (euchre, 200)),
+    ('dice', (dice, 2000)),
+])
+
+
+ENGINES = OrderedDict([
+    ('tree', lambda game, state, seed: MCTS(game, state, seed=seed)),
+    ('rollout', lambda game, state, seed: MCTS(game, state, rollout=True,
+                                               seed=seed)),
+    ('compact', lambda game, state, seed: CompactMCTS(game, state,
+                                                      seed=seed)),
+])
+
+
+def count_nodes(root):
+    if hasattr(root, 'tree'):
+        return len(root.tree)
+    return tree_size(root)
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def run_benchmark(game_name, engine_name, iterations=None, seed=0):
+    make_game, default_iterations = GAMES[game_name]
+    if iterations is None:
+        iterations = default_iterations
+    random.seed(seed)
+    game, state = make_game()
+    mcts = ENGINES[engine_name](game, state, seed)
+    start_time = time()
+    result = mcts.get_simulation_result(iterations)
+    seconds = time() - start_time
+    return OrderedDict([
+        ('game', game_name),
+        ('engine', engine_name),
+        ('iterations', iterations),
+        ('seed', seed),
+        ('seconds', seconds),
+        ('iterations_per_second', iterations / seconds),
+        ('nodes', count_nodes(result.root)),
+        ('avg_depth', result.avg_depth),
+        ('max_depth', result.max_depth),
+        ('peak_rss_kb', peak_rss_kb()),
+    ])
+
+
+# the numbers of threads the thread benchmark searches with
+THREADS = [1, 2, 4, 8]
+
+
+def run_thread_benchmark(game_name, iterations=None, seed=0,
+                         thread_counts=THREADS):
+    make_game, default_iterations = GAMES[game_name]
+    if iterations is None:
+        iterations = default_iterations
+    results = []
+    for threads in thread_counts:
+        random.seed(seed)
+        game, state = make_game()
+        # searches only fall back to one thread for games that do not say
+        # they release the GIL
+        game = type(game.__name__, (game,), {'releases_gil': True})
+        mcts = MCTS(game, state, rollout=True, seed=seed)
+        start_time = time()
+        mcts.get_simulation_result(iterations, threads=threads)
+        seconds = time() - start_time
+        results.append(OrderedDict([
+            ('game', game_name),
+            ('threads', threads),
+            ('iterations', iterations),
+            ('seconds', seconds),
+            ('iterations_per_second', iterations / seconds),
+            ('speedup', results and results[0]['seconds'] / seconds or 1.0),
+            ('gil', gil_enabled()),
+        ]))
+    return results
+
+
+def euchre_determinization_states():
+    from test.euchre import EuchreGame
+    start = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+    middle = start._replace(trump_card='jd',
+                            trump='d',
+                            cards_played=['jd', 'ad', 'kd', 'qd', 'qc'],
+                            tricks_won_by_team=[1, 0],
+                            hands=[['jc', 'kc', 'ah', 'js'], [], [], []],
+                            voids_by_player=[set(),
+                                             set(['d', 'h', 'c']),
+                                             set(),
+                                             set(['s', 'c', 'd'])])
+    return OrderedDict([('start', start), ('voids', middle)])
+
+
+def run_determinization_benchmark(count=200, seed=0):
+    from test.euchre import EuchreGame, determine_with_csp
+    results = []
+    for name, state in euchre_determinization_states().items():
+        for implementation, determine in [('sampler', EuchreGame.determine),
+                                          ('csp', determine_with_csp)]:
+            rng = random.Random(seed)
+            start_time = time()
+            for _ in range(count):
+                determine(state, random=rng)
+            seconds = time() - start_time
+            results.append(OrderedDict([
+                ('state', name),
+                ('implementation', implementation),
+                ('determinizations', count),
+                ('seconds', seconds),
+                ('determinizations_per_second', count / seconds),
+            ]))
+    return results
+
+
+def _run_benchmark(args):
+    return run_benchmark(*args)
+
+
+def run_benchmarks(games, engines, iterations=None, seed=0):
+    cases = [(game_name, engine_name, iterations, seed)
+             for game_name in games
+             for engine_name in engines]
+    # a fresh process per benchmark keeps their peak RSS apart
+    pool = _process_pool(1, maxtasksperchild=1)
+    try:
+        results = pool.map(_run_benchmark, cases, chunksize=1)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', nargs='+', choices=list(GAMES),
+                        default=list(GAMES))
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES),
+                        default=list(ENGINES))
+    parser.add_argument('--iterations', type=int,
+                        help='iterations for every game instead of the '
+                             'defaults')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='file to write the results to')
+    parser.add_argument('--determinizations', action='store_true',
+                        help='compare Euchre determinization speeds instead')
+    parser.add_argument('--threads', action='store_true',
+                        help='measure the scaling of searches with threads '
+                             'instead')
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        results = []
+        for game_name in args.games:
+            if game_name == 'euchre':
+                # threads cannot share a tree between determinizations
+                continue
+            results.extend(run_thread_benchmark(game_name, args.iterations,
+                                                args.seed))
+        print('GIL enabled: {}'.format(gil_enabled()))
+        print('{:<10} {:>7} {:>12} {:>8}'.format('game', 'threads',
+                                                 'iter/sec', 'speedup'))
+        for result in results:
+            print('{game:<10} {threads:>7} {iterations_per_second:>12.1f} '
+                  '{speedup:>8.2f}'.format(**result))
+        write_json(args.json, results)
+        return results
+
+    if args.determinizations:
+        results = run_determinization_benchmark(seed=args.seed)
+        print('{:<8} {:<8} {:>12}'.format('state', 'deal', 'dets/sec'))
+        for result in results:
+            print('{state:<8} {implementation:<8} '
+                  '{determinizations_per_second:>12.1f}'.format(**result))
+        write_json(args.json, results)
+        return results
+
+    results = run_benchmarks(args.games, args.engines, args.iterations,
+                             args.seed)
+    print('{:<10} {:<8} {:>10} {:>12} {:>8} {:>9} {:>9} {:>12}'.format(
+        'game', 'engine', 'iterations', 'iter/sec', 'nodes', 'avg depth',
+        'max depth', 'peak rss kb'))
+    for result in results:
+        print('{game:<10} {engine:<8} {iterations:>10} '
+              '{iterations_per_second:>12.1f} {nodes:>8} {avg_depth:>9.2f} '
+              '{max_depth:>9} {peak_rss_kb!s:>12}'.format(**result))
+    write_json(args.json, results)
+    return results
+
+
+def write_json(path, results):
+    if path:
+        with open(path, 'w') as output:
+            json.dump({'python': platform.python_version(),
+                       'implementation': platform.python_implementation(),
+                       'results': results}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
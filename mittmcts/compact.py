@@ -0,0 +1,279 @@
+"""An MCTS engine that keeps its tree in flat arrays instead of Node objects.
+
+Every node is an integer handle into a set of columns (visits, draws, wins
+per player, parent, first child, next sibling and move id) so a node costs
+a few machine words. States are not stored at all: every iteration replays
+the selected moves from the (determined) initial state and then plays the
+rest of the game out, adding one node per iteration."""
+
+from array import array
+from copy import deepcopy
+from math import sqrt, log
+from time import time
+
+from six import iteritems
+
+from mittmcts import (
+    Draw, MCTSResult, determinization_sampler, make_random, play_out,
+    takes_random
+)
+
+
+NO_NODE = -1
+
+
+class CompactTree(object):
+    """A structure of arrays tree. The root is handle 0."""
+
+    def __init__(self):
+        self.visits = array('l')
+        self.draws = array('l')
+        self.parent = array('l')
+        self.first_child = array('l')
+        self.next_sibling = array('l')
+        self.move_id = array('l')
+        self.wins_by_player = {}
+        self.moves = []
+        self.move_ids = {}
+        self.add_node(NO_NODE, None)
+
+    def __len__(self):
+        return len(self.visits)
+
+    def add_node(self, parent, move):
+        handle = len(self.visits)
+        move_id = self.move_ids.get(move)
+        if move_id is None:
+            move_id = self.move_ids[move] = len(self.moves)
+            self.moves.append(move)
+        self.visits.append(0)
+        self.draws.append(0)
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        self.move_id.append(move_id)
+        for wins in self.wins_by_player.values():
+            wins.append(0)
+        if parent == NO_NODE:
+            self.next_sibling.append(NO_NODE)
+        else:
+            self.next_sibling.append(self.first_child[parent])
+            self.first_child[parent] = handle
+        return handle
+
+    def move(self, handle):
+        return self.moves[self.move_id[handle]]
+
+    def children(self, handle):
+        child = self.first_child[handle]
+        while child != NO_NODE:
+            yield child
+            child = self.next_sibling[child]
+
+    def children_by_move(self, handle):
+        moves = self.moves
+        move_id = self.move_id
+        return {moves[move_id[child]]: child
+                for child in self.children(handle)}
+
+    def wins(self, player):
+        wins = self.wins_by_player.get(player)
+        if wins is None:
+            wins = array('l', [0]) * len(self)
+            self.wins_by_player[player] = wins
+        return wins
+
+    def backprop(self, handle, winner):
+        if winner is Draw:
+            counts = self.draws
+        else:
+            counts = self.wins(winner)
+        visits = self.visits
+        parent = self.parent
+        while handle != NO_NODE:
+            visits[handle] += 1
+            counts[handle] += 1
+            handle = parent[handle]
+
+    @property
+    def nbytes(self):
+        columns = [self.visits, self.draws, self.parent, self.first_child,
+                   self.next_sibling, self.move_id]
+        columns.extend(self.wins_by_player.values())
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+class CompactNode(object):
+    """A read-only view of a node in a CompactTree with the attributes of a
+    Node that are used for reporting"""
+
+    def __init__(self, tree, handle, game, c, parent=None, state=None):
+        self.tree = tree
+        self.handle = handle
+        self.game = game
+        self.c = c
+        self.parent = parent
+        self.__state = state
+
+    @property
+    def move(self):
+        return self.tree.move(self.handle)
+
+    @property
+    def visits(self):
+        return self.tree.visits[self.handle]
+
+    @property
+    def draws(self):
+        return self.tree.draws[self.handle]
+
+    @property
+    def wins_by_player(self):
+        return {player: wins[self.handle]
+                for player, wins in iteritems(self.tree.wins_by_player)
+                if wins[self.handle]}
+
+    @property
+    def state(self):
+        if self.__state is None:
+            self.__state = self.game.apply_move(self.parent.state, self.move)
+        return self.__state
+
+    @property
+    def winner(self):
+        return self.game.get_winner(self.state)
+
+    @property
+    def current_player(self):
+        return self.game.current_player(self.state)
+
+    @property
+    def children(self):
+        return [CompactNode(self.tree, child, self.game, self.c, parent=self)
+                for child in reversed(list(self.tree.children(self.handle)))]
+
+    def ucb1(self, player):
+        if not self.parent:
+            return 0
+        wins_by_player = self.wins_by_player.get(player, 0)
+        try:
+            return ((float(wins_by_player + (self.draws * 0.5)) /
+                     self.visits) +
+                    (self.c * sqrt(log(self.parent.visits) / self.visits)))
+        except (ZeroDivisionError, ValueError):
+            return 0
+
+    def most_visited_child(self, actual_options=None):
+        children = self.children
+        if actual_options:
+            children = [child for child in children
+                        if child.move in actual_options]
+        if not children:
+            raise Exception('No children when trying to find most visited '
+                            'move\n actual_options=%r' % (actual_options,))
+        return sorted(children, key=lambda c: c.visits)[-1]
+
+    def __repr__(self):
+        return 'handle=%r move=%r visits=%r wins=%r' % (
+            self.handle, self.move, self.visits, self.wins_by_player)
+
+
+class CompactMCTS(object):
+    """Runs the select/expand one/rollout/backprop search of
+    MCTS(game, rollout=True) on a CompactTree. Games that implement
+    determine are searched with ISMCTS. update_misc is not supported.
+    Once the tree has max_nodes nodes it stops growing."""
+
+    def __init__(self, game, initial_state=None, c=sqrt(2), seed=None,
+                 max_nodes=None):
+        self.game = game
+        self.c = c
+        self.max_nodes = max_nodes
+        self.random = make_random(seed)
+        if initial_state:
+            self.__initial_state = initial_state
+        elif takes_random(game.initial_state):
+            self.__initial_state = game.initial_state(random=self.random)
+        else:
+            self.__initial_state = game.initial_state()
+
+        self.__initial_state = deepcopy(self.__initial_state)
+
+    def get_simulation_result(self,
+                              iterations=1,
+                              actual_options=None,
+                              max_seconds=None):
+        game = self.game
+        random = self.random
+        max_nodes = self.max_nodes or float('inf')
+        tree = CompactTree()
+        if max_seconds:
+            iterations = float('inf')
+        plays = 0
+        max_depth = 0
+        total_depth = 0
+        sampler = None
+        if hasattr(game, 'determine'):
+            sampler = determinization_sampler(game, self.__initial_state,
+                                              random)
+        start_time = time()
+        while plays < iterations:
+            if max_seconds is not None and time() - start_time > max_seconds:
+                break
+            state = self.__initial_state
+            if sampler is not None:
+                state = sampler()
+            handle = 0
+            depth = 0
+            while game.get_winner(state) is None:
+                is_random, moves = game.get_moves(state)
+                if not moves:
+                    break
+                children = tree.children_by_move(handle)
+                if is_random:
+                    move = random.choice(moves)
+                    child = children.get(move, NO_NODE)
+                else:
+                    untried_moves = [move for move in moves
+                                     if move not in children]
+                    if untried_moves:
+                        move = random.choice(untried_moves)
+                        child = NO_NODE
+                    else:
+                        child = self.best_child(
+                            tree, handle,
+                            [children[move] for move in moves],
+                            game.current_player(state))
+                        move = tree.move(child)
+                state = game.apply_move(state, move)
+                depth += 1
+                if child == NO_NODE:
+                    if len(tree) < max_nodes:
+                        handle = tree.add_node(handle, move)
+                    break
+                handle = child
+            state, rollout_depth = play_out(game, state, random)
+            tree.backprop(handle, game.get_winner(state))
+            depth += rollout_depth
+            max_depth = max(max_depth, depth)
+            total_depth += depth
+            plays += 1
+
+        root_node = CompactNode(tree, 0, game, self.c,
+                                state=self.__initial_state)
+        move = root_node.most_visited_child(actual_options).move
+        return MCTSResult(root=root_node,
+                          move=move,
+                          leaf_nodes=[],
+                          avg_depth=float(total_depth) / plays,
+                          max_depth=max_depth)
+
+    def best_child(self, tree, handle, children, player):
+        wins = tree.wins(player)
+        draws = tree.draws
+        visits = tree.visits
+        c = self.c
+        log_visits = log(visits[handle])
+        return max(children,
+                   key=lambda child: (
+                       (wins[child] + draws[child] * 0.5) / visits[child] +
+                       c * sqrt(log_visits / visits[child])))
@@ -0,0 +1,299 @@
+"""Plays matches between agents to compare engine settings.
+
+Run from the root of the repository (the games live in the test package):
+
+    python -m mittmcts.tournament --game connect4 --games 200 \
+        --agents mcts:iterations=500 mcts:iterations=500,c=0.7 \
+        --processes 4 --jsonl games.jsonl
+
+Agents take turns in every seat. The result of every game is written to the
+JSONL file as soon as it is played. The summary has every agent's score (a
+draw counts as half a win) with a Wilson confidence interval, games per
+second and percentiles of the time agents took to pick a move.
+
+Games with hidden information are dealt with their determine method at the
+start of every game. Agents only see the state returned by the game's
+visible_state(state) hook, if the game defines one."""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import json
+from math import ceil, sqrt
+from random import Random
+from time import time
+
+from mittmcts import MCTS, Draw, _process_pool, determine, takes_random
+from mittmcts.bench import GAMES
+
+
+# game name (see mittmcts.bench.GAMES) -> the players of the game in the
+# order agents are seated
+PLAYERS = OrderedDict([
+    ('tictactoe', ['X', 'O']),
+    ('connect4', [0, 1]),
+    ('euchre', [0, 1]),
+])
+
+
+class RandomAgent(object):
+    """Plays a random legal move"""
+
+    def __init__(self, name='random'):
+        self.name = name
+
+    def choose(self, game, state, moves, random):
+        return random.choice(moves)
+
+
+class MCTSAgent(object):
+    """Plays the move found by a new MCTS search of iterations iterations
+    (or max_seconds seconds). options are passed to MCTS (c, rollout,
+    transpositions, solver...)."""
+
+    def __init__(self, name=None, iterations=1000, max_seconds=None,
+                 **options):
+        if name is None:
+            name = 'mcts:' + ','.join(
+                '{}={}'.format(key, value)
+                for key, value in sorted(dict(options,
+                                              iterations=iterations,
+                                              max_seconds=max_seconds).items())
+                if value is not None)
+        self.name = name
+        self.iterations = iterations
+        self.max_seconds = max_seconds
+        self.options = options
+
+    def choose(self, game, state, moves, random):
+        mcts = MCTS(game, state, seed=random, **self.options)
+        return mcts.get_simulation_result(self.iterations,
+                                          actual_options=moves,
+                                          max_seconds=self.max_seconds).move
+
+
+def parse_agent(spec):
+    """Makes an agent from random or mcts:key=value,key=value where the
+    values are numbers (c=0.7, iterations=500, rollout=1...)"""
+    kind, _, arguments = spec.partition(':')
+    if kind == 'random':
+        return RandomAgent(spec)
+    if kind != 'mcts':
+        raise ValueError('Unknown agent %r' % (spec,))
+    options = {}
+    for argument in filter(None, arguments.split(',')):
+        key, _, value = argument.partition('=')
+        number = float(value)
+        options[key] = int(number) if number.is_integer() else number
+    return MCTSAgent(spec, **options)
+
+
+def play_game(game, seats, seed, state=None):
+    """Plays one game (from state or a new initial state) with seats mapping
+    every player to their agent and returns the result as a dict that can
+    be dumped to JSON"""
+    random = Random(seed)
+    if state is None and takes_random(game.initial_state):
+        state = game.initial_state(random=random)
+    elif state is None:
+        state = game.initial_state()
+    if hasattr(game, 'determine'):
+        state = determine(game, state, random)
+    visible_state = getattr(game, 'visible_state', None)
+    latencies = dict((agent.name, []) for agent in seats.values())
+    moves_played = 0
+    start_time = time()
+    while game.get_winner(state) is None:
+        is_random, moves = game.get_moves(state)
+        if is_random:
+            move = random.choice(moves)
+        else:
+            agent = seats[game.current_player(state)]
+            view = state
+            if visible_state is not None:
+                view = visible_state(state)
+            move_start_time = time()
+            move = agent.choose(game, view, moves,
+                                Random(random.getrandbits(64)))
+            latencies[agent.name].append(time() - move_start_time)
+        state = game.apply_move(state, move)
+        moves_played += 1
+    winner = game.get_winner(state)
+    return OrderedDict([
+        ('seed', seed),
+        ('seats', [[player, agent.name]
+                   for player, agent in seats.items()]),
+        ('winner', None if winner is Draw else seats[winner].name),
+        ('moves', moves_played),
+        ('seconds', time() - start_time),
+        ('latencies', latencies),
+    ])
+
+
+def wilson_interval(score, games, z=1.96):
+    """The Wilson score interval of a win rate"""
+    if not games:
+        return 0.0, 1.0
+    rate = float(score) / games
+    center = rate + z * z / (2 * games)
+    spread = z * sqrt(rate * (1 - rate) / games + z * z / (4 * games * games))
+    denominator = 1 + z * z / games
+    return (max(0.0, (center - spread) / denominator),
+            min(1.0, (center + spread) / denominator))
+
+
+def percentile(values, fraction):
+    """The nearest rank percentile of values (which must be sorted)"""
+    if not values:
+        return None
+    return values[max(0, int(ceil(fraction * len(values))) - 1)]
+
+
+def format_latency(seconds):
+    """seconds for the results table, or - for an agent that never moved"""
+    if seconds is None:
+        return '-'
+    return '{:.3f}s'.format(seconds)
+
+
+def summarize(results, agents, seconds):
+    summary = OrderedDict([('games', len(results)),
+                           ('seconds', seconds),
+                           ('games_per_second', seconds and
+                            len(results) / seconds),
+                           ('agents', [])])
+    for agent in agents:
+        games = wins = draws = 0
+        latencies = []
+        for result in results:
+            if agent.name not in result['latencies']:
+                continue
+            games += 1
+            if result['winner'] == agent.name:
+                wins += 1
+            elif result['winner'] is None:
+                draws += 1
+            latencies.extend(result['latencies'][agent.name])
+        latencies.sort()
+        score = wins + draws * 0.5
+        low, high = wilson_interval(score, games)
+        summary['agents'].append(OrderedDict([
+            ('agent', agent.name),
+            ('games', games),
+            ('wins', wins),
+            ('draws', draws),
+            ('losses', games - wins - draws),
+            ('score', games and score / games),
+            ('score_low', low),
+            ('score_high', high),
+            ('moves', len(latencies)),
+            ('latency_p50', percentile(latencies, 0.5)),
+            ('latency_p90', percentile(latencies, 0.9)),
+            ('latency_p99', percentile(latencies, 0.99)),
+        ]))
+    return summary
+
+
+def schedule(agents, players, games, seed):
+    """Seats the agents in turn so every agent plays every seat as often"""
+    for index in range(games):
+        seats = OrderedDict(
+            (player, agents[(index + seat) % len(agents)])
+            for seat, player in enumerate(players))
+        yield index, seats, seed + index
+
+
+_worker_match = None
+
+
+def _init_worker(game, state):
+    global _worker_match
+    _worker_match = game, state
+
+
+def _play_game(task):
+    index, seats, seed = task
+    game, state = _worker_match
+    return index, play_game(game, seats, seed, state)
+
+
+def run_match(game, agents, players, games=100, seed=0, processes=None,
+              output=None, state=None):
+    """Plays games games of game between agents (seated in turn as players)
+    and returns the results of the games (in the order they were
+    scheduled) and the summary. Every game starts from state or a new
+    initial state seeded with the game's seed. With processes the games
+    are played in a pool of processes. output is a file the results are
+    written to as JSON lines as they come in."""
+    if len(agents) < 2 and len(players) > 1:
+        raise ValueError('A match needs at least two agents')
+    if len(set(agent.name for agent in agents)) != len(agents):
+        raise ValueError('Agents need to have different names')
+    tasks = schedule(agents, players, games, seed)
+    start_time = time()
+    pool = None
+    if processes is not None and processes > 1:
+        pool = _process_pool(processes, _init_worker, (game, state))
+        played = pool.imap_unordered(_play_game, tasks)
+    else:
+        played = ((index, play_game(game, seats, seed, state))
+                  for index, seats, seed in tasks)
+    results = {}
+    try:
+        for index, result in played:
+            results[index] = result
+            if output is not None:
+                line = OrderedDict([('game', index)])
+                line.update(result)
+                output.write(json.dumps(line) + '\n')
+                output.flush()
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    results = [results[index] for index in sorted(results)]
+    return results, summarize(results, agents, time() - start_time)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--game', choices=list(PLAYERS), default='tictactoe')
+    parser.add_argument('--agents', nargs='+',
+                        default=['mcts:iterations=200', 'random'],
+                        help='random or mcts:key=value,... with MCTS '
+                             'options, iterations and max_seconds')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--jsonl', help='file to write every game to')
+    args = parser.parse_args(argv)
+
+    game, _ = GAMES[args.game][0]()
+    agents = [parse_agent(spec) for spec in args.agents]
+    output = args.jsonl and open(args.jsonl, 'w')
+    try:
+        _, summary = run_match(game, agents, PLAYERS[args.game], args.games,
+                               args.seed, args.processes, output)
+    finally:
+        if output:
+            output.close()
+
+    print('{games} games in {seconds:.1f}s '
+          '({games_per_second:.2f} games/sec)'.format(**summary))
+    print('{:<32} {:>6} {:>6} {:>6} {:>6} {:>15} {:>9} {:>9}'.format(
+        'agent', 'wins', 'draws', 'losses', 'score', '95% interval',
+        'p50 move', 'p99 move'))
+    for agent in summary['agents']:
+        print('{agent:<32} {wins:>6} {draws:>6} {losses:>6} {score:>6.3f} '
+              '{score_low:>7.3f}-{score_high:<7.3f} {p50:>9} {p99:>9}'.format(
+                  p50=format_latency(agent['latency_p50']),
+                  p99=format_latency(agent['latency_p99']),
+                  **agent))
+    return summary
+
+
+if __name__ == '__main__':
+    main()
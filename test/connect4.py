@@ -1,4 +1,5 @@
 from collections import namedtuple
+from math import tanh
 
 from six.moves import range
 from mittmcts import Draw
@@ -33,12 +34,6 @@ def check_win(bitboard):
             (vert & (vert >> 2)))
 
 
-def check_top_row(board):
-    return [column for column, piece
-            in enumerate(board[0])
-            if piece is None]
-
-
 def get_bitboards(board):
     bitboards = [0, 0]
     for player in range(2):
@@ -49,56 +44,109 @@ def get_bitboards(board):
     return bitboards
 
 
-def find_row_for_column(board, column):
-    for row, pieces in enumerate(reversed(board)):
-        if pieces[column] is None:
-            return 5 - row
-    raise Exception('No empty spot in that column')
+def get_board(bitboards):
+    board = empty_board()
+    for player, bitboard in enumerate(bitboards):
+        for row in range(6):
+            for column in range(7):
+                if bitboard >> bitboard_lookup[row][column] & 1:
+                    board[row][column] = player
+    return board
+
+
+# every column takes 7 bits: 6 for the pieces from the bottom up and an
+# empty bit on top so wins can't wrap around to the next column
+bottom_mask = [1 << (7 * column) for column in range(7)]
+top_mask = [1 << (7 * column + 5) for column in range(7)]
+column_mask = [0b111111 << (7 * column) for column in range(7)]
+full_mask = sum(column_mask)
+# the shifts from a piece to its neighbour down, across and on both
+# diagonals (see check_win)
+directions = [1, 7, 6, 8]
+# moves in the middle are part of more lines
+column_priors = [1 / 16.0, 2 / 16.0, 3 / 16.0, 4 / 16.0, 3 / 16.0,
+                 2 / 16.0, 1 / 16.0]
+
+
+def count_pairs(bitboard, empty):
+    """Counts the pairs of neighbouring pieces with room to grow"""
+    pairs = 0
+    for shift in directions:
+        pair = bitboard & (bitboard >> shift)
+        pairs += bin((pair >> shift) & empty).count('1')
+        pairs += bin((pair << (2 * shift)) & empty).count('1')
+    return pairs
 
 
 class ConnectFourGame(object):
-    """A simple connection game"""
+    """A simple connection game
+
+    The state only holds a bitboard per player (see bitboard_lookup). The
+    pieces of both players added to the bottom of a column give the next
+    free spot in it so moves are made without looking at the board."""
     State = namedtuple('ConnectFourState',
-                       ['board',
-                        'bitboards',
+                       ['bitboards',
                         'winner',
                         'current_player'])
 
     @classmethod
     def initial_state(cls):
-        return cls.State(board=empty_board(),
-                         bitboards=[0, 0],
+        return cls.State(bitboards=(0, 0),
                          winner=None,
                          current_player=0)
 
     @classmethod
-    def apply_move(cls, state, column):
-        bitboards = state.bitboards[:]
-        board = [row[:] for row in state.board]
+    def from_board(cls, board, current_player=0):
+        bitboards = tuple(get_bitboards(board))
         winner = None
-
-        row = find_row_for_column(board, column)
-
-        board[row][column] = state.current_player
-        bitboards[state.current_player] ^= 1 << bitboard_lookup[row][column]
-
         for player, bitboard in enumerate(bitboards):
             if check_win(bitboard):
                 winner = player
-
-        if not check_top_row(board) and not winner:
+        if winner is None and bitboards[0] | bitboards[1] == full_mask:
             winner = Draw
+        return cls.State(bitboards=bitboards,
+                         winner=winner,
+                         current_player=current_player)
 
-        current_player = (state.current_player + 1) % 2
+    @staticmethod
+    def board(state):
+        return get_board(state.bitboards)
+
+    @classmethod
+    def apply_move(cls, state, column):
+        bitboards = state.bitboards
+        player = state.current_player
+        pieces = bitboards[0] | bitboards[1]
+        if pieces & top_mask[column]:
+            raise ValueError('No empty spot in that column')
+
+        bitboard = (bitboards[player] |
+                    ((pieces + bottom_mask[column]) & column_mask[column]))
+        if player == 0:
+            bitboards = (bitboard, bitboards[1])
+        else:
+            bitboards = (bitboards[0], bitboard)
+
+        # only the player who moved can have won
+        winner = None
+        if check_win(bitboard):
+            winner = player
+        elif bitboards[0] | bitboards[1] == full_mask:
+            winner = Draw
 
-        return cls.State(board=board,
-                         bitboards=bitboards,
+        return cls.State(bitboards=bitboards,
                          winner=winner,
-                         current_player=current_player)
+                         current_player=1 - player)
 
     @staticmethod
     def get_moves(state):
-        return False, check_top_row(state.board)
+        pieces = state.bitboards[0] | state.bitboards[1]
+        return False, [column for column in range(7)
+                       if not pieces & top_mask[column]]
+
+    @staticmethod
+    def state_key(state):
+        return state.bitboards
 
     @staticmethod
     def get_winner(state):
@@ -107,3 +155,20 @@ class ConnectFourGame(object):
     @staticmethod
     def current_player(state):
         return state.current_player
+
+    @classmethod
+    def evaluate(cls, states):
+        """A cheap evaluator for MCTS(evaluator=...): the player with more
+        pairs of pieces that can still grow is ahead and moves in the middle
+        are preferred"""
+        evaluations = []
+        for state in states:
+            bitboards = state.bitboards
+            empty = full_mask & ~(bitboards[0] | bitboards[1])
+            lead = (count_pairs(bitboards[0], empty) -
+                    count_pairs(bitboards[1], empty))
+            value = 0.5 + 0.5 * tanh(lead / 8.0)
+            _, moves = cls.get_moves(state)
+            priors = dict((move, column_priors[move]) for move in moves)
+            evaluations.append(({0: value, 1: 1 - value}, priors))
+        return evaluations
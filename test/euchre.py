@@ -1,11 +1,10 @@
-from collections import namedtuple
-from random import shuffle, choice
+from collections import namedtuple, OrderedDict
 from itertools import chain
-
-from constraint import AllDifferentConstraint, Problem
+from math import factorial
+import random as global_random
 
 from six import iteritems
-from six.moves import filter, range
+from six.moves import range
 
 
 def chunks(l, n):
@@ -47,32 +46,80 @@ def second_highest_jack(trump):
     return 'j' + same_color[trump]
 
 
+card_values = {
+    '9': 9,
+    '0': 10,
+    'j': 11,
+    'q': 12,
+    'k': 13,
+    'a': 14
+}
+
+
 def value(card):
-    return {
-        '9': 9,
-        '0': 10,
-        'j': 11,
-        'q': 12,
-        'k': 13,
-        'a': 14
-    }[card[0]]
+    return card_values[card[0]]
+
+
+def effective_suit(trump, card):
+    if card == second_highest_jack(trump):
+        return trump
+    return card[1]
+
+
+def trick_key(trump, lead_suit, card):
+    return (card == jack_of_trump(trump),
+            card == second_highest_jack(trump),
+            effective_suit(trump, card) == trump,
+            effective_suit(trump, card) == lead_suit,
+            value(card))
+
+
+# Cards are identified by a bit in masks of cards and every helper used while
+# playing looks its answer up in tables built once for every trump (and lead
+# suit) instead of working it out from the card names.
+
+# card -> bit
+card_bits = {card: 1 << index for index, card in enumerate(deal())}
+
+# trump -> card -> suit the card follows
+effective_suits = {trump: {card: effective_suit(trump, card)
+                           for card in deal()}
+                   for trump in suits}
+
+# trump -> suit -> mask of the cards that follow the suit
+suit_masks = {trump: {suit: sum(card_bits[card] for card in deal()
+                                if effective_suits[trump][card] == suit)
+                      for suit in suits}
+              for trump in suits}
+
+
+def rank_cards(trump, lead_suit):
+    keys = sorted(set(trick_key(trump, lead_suit, card) for card in deal()))
+    rank_by_key = {key: rank for rank, key in enumerate(keys)}
+    return {card: rank_by_key[trick_key(trump, lead_suit, card)]
+            for card in deal()}
+
+
+# trump -> lead suit -> card -> rank (the highest rank wins the trick)
+ranks = {trump: {lead_suit: rank_cards(trump, lead_suit)
+                 for lead_suit in suits + [None]}
+         for trump in suits}
 
 
 def sort_by_trump_and_lead(trump, lead_suit, cards):
-    return sorted(cards,
-                  key=lambda c: (c == jack_of_trump(trump),
-                                 c == second_highest_jack(trump),
-                                 suit(trump, c) == trump,
-                                 suit(trump, c) == lead_suit,
-                                 value(c)),
+    return sorted(cards, key=ranks[trump][lead_suit].__getitem__,
                   reverse=True)
 
 
 def winning_card(trump, lead_suit, cards):
-    return sort_by_trump_and_lead(trump, lead_suit, cards)[0]
+    return max(cards, key=ranks[trump][lead_suit].__getitem__)
 
 
 def suit(trump, card):
+    try:
+        return effective_suits[trump][card]
+    except KeyError:
+        pass
     if card == second_highest_jack(trump):
         return trump
     if card is not None:
@@ -86,8 +133,9 @@ def playable_cards(trump, lead_suit, hand):
     if lead_suit is None:
         return hand
 
+    lead_mask = suit_masks[trump][lead_suit]
     must_play = [card for card in hand
-                 if suit(trump, card) == lead_suit]
+                 if card_bits[card] & lead_mask]
     if must_play:
         return must_play
 
@@ -98,7 +146,188 @@ def potential_cards_given_voids(trump, voids, cards):
     """During the simulation we will distribute cards to players and track
     when they have played off on a certain lead. This function returns the
     cards a player can select when they have played off on certain suits"""
-    return [card for card in cards if suit(trump, card) not in voids]
+    void_mask = 0
+    for void in voids:
+        void_mask |= suit_masks[trump][void]
+    return [card for card in cards if not card_bits[card] & void_mask]
+
+
+def hand_sizes(state):
+    remaining_hand_size = 5 - sum(state.tricks_won_by_team)
+    return [remaining_hand_size - (card is not None and 1 or 0)
+            for card in state.cards_played_by_player]
+
+
+def unseen_cards(state):
+    seen = set(chain(*state.hands)) | set(state.cards_played)
+    return [card for card in deal() if card not in seen]
+
+
+def hidden_hands_dealer(trump, hands, hand_sizes, voids_by_player, cards,
+                        shuffles=20):
+    """Returns a function of a random number generator that deals cards to
+    the players whose hands are empty so that nobody gets a card of a suit
+    they are void in, every such deal being equally likely.
+
+    Up to shuffles deals of shuffled cards are tried first, keeping the
+    first one that meets the voids. Should they all break a void, the cards
+    are dealt a group at a time instead, a group being the cards the same
+    players can hold: every split of a group between those players (and
+    nobody, for cards left over) is picked with a probability proportional
+    to the number of deals it leaves. Both ways deal every consistent deal
+    with the same probability. The numbers of deals are only worked out
+    the first time they are needed."""
+    players = [player for player in range(4)
+               if not hands[player] and hand_sizes[player]]
+    leftover = len(cards) - sum(hand_sizes[player] for player in players)
+    if leftover < 0:
+        raise ValueError('Not enough cards to deal %r' % (hand_sizes,))
+    # seats are the players dealt to and a last seat for the cards nobody
+    # gets
+    void_masks = []
+    for player in players:
+        void_mask = 0
+        for void in voids_by_player[player]:
+            void_mask |= suit_masks[trump][void]
+        void_masks.append(void_mask)
+    # cards that can go to the same seats are dealt together
+    cards_by_seats = OrderedDict()
+    for card in cards:
+        seats = tuple(seat for seat, void_mask in enumerate(void_masks)
+                      if not card_bits[card] & void_mask) + (len(players),)
+        cards_by_seats.setdefault(seats, []).append(card)
+    groups = list(cards_by_seats.items())
+    completions = {}
+
+    def splits(seats, cards_left, capacities):
+        """Every way to split cards_left cards between seats as
+        (seat, cards) pairs"""
+        if len(seats) == 1:
+            if cards_left <= capacities[seats[0]]:
+                yield ((seats[0], cards_left),)
+            return
+        seat = seats[0]
+        for dealt in range(min(cards_left, capacities[seat]) + 1):
+            for split in splits(seats[1:], cards_left - dealt, capacities):
+                yield ((seat, dealt),) + split
+
+    def weighted_splits(index, capacities):
+        """The splits of group index with the number of ways to deal its
+        cards and the rest of the groups after each"""
+        seats, group_cards = groups[index]
+        for split in splits(seats, len(group_cards), capacities):
+            left = list(capacities)
+            ways = factorial(len(group_cards))
+            for seat, dealt in split:
+                left[seat] -= dealt
+                ways //= factorial(dealt)
+            yield split, ways * count(index + 1, tuple(left))
+
+    def count(index, capacities):
+        """The number of ways to deal the groups from index on to seats
+        with room for capacities more cards"""
+        if index == len(groups):
+            return 1
+        key = index, capacities
+        if key not in completions:
+            completions[key] = sum(ways for _, ways
+                                   in weighted_splits(index, capacities))
+        return completions[key]
+
+    initial_capacities = tuple(hand_sizes[player]
+                               for player in players) + (leftover,)
+    cards_dealt = len(cards) - leftover
+
+    def shuffled_deal(random):
+        dealt = random.sample(cards, cards_dealt)
+        new_hands = hands[:]
+        start = 0
+        for player, void_mask in zip(players, void_masks):
+            hand = dealt[start:start + hand_sizes[player]]
+            start += hand_sizes[player]
+            if any(card_bits[card] & void_mask for card in hand):
+                return None
+            new_hands[player] = hand
+        return new_hands
+
+    def deal_hands(random):
+        for _ in range(shuffles):
+            new_hands = shuffled_deal(random)
+            if new_hands is not None:
+                return new_hands
+        if not count(0, initial_capacities):
+            raise ValueError('Could not deal hands consistent with '
+                             'voids_by_player=%r' % (voids_by_player,))
+        new_hands = hands[:]
+        for player in players:
+            new_hands[player] = []
+        capacities = initial_capacities
+        for index, (_, group_cards) in enumerate(groups):
+            point = random.randrange(count(index, capacities))
+            for split, ways in weighted_splits(index, capacities):
+                point -= ways
+                if point < 0:
+                    break
+            group_cards = group_cards[:]
+            random.shuffle(group_cards)
+            left = list(capacities)
+            for seat, dealt in split:
+                left[seat] -= dealt
+                if seat < len(players):
+                    new_hands[players[seat]].extend(group_cards[:dealt])
+                del group_cards[:dealt]
+            capacities = tuple(left)
+        for player in players:
+            random.shuffle(new_hands[player])
+        return new_hands
+    return deal_hands
+
+
+def deal_hidden_hands(trump, hands, hand_sizes, voids_by_player, cards,
+                      random, shuffles=20):
+    """Deals the hidden hands once, see hidden_hands_dealer"""
+    return hidden_hands_dealer(trump, hands, hand_sizes, voids_by_player,
+                               cards, shuffles)(random)
+
+
+def determine_with_csp(state, random=None):
+    """The original determinization that deals the hidden cards by solving a
+    constraint satisfaction problem with python-constraint. It is much
+    slower than EuchreGame.determine and only kept to compare the two."""
+    from constraint import AllDifferentConstraint, Problem
+
+    if random is None:
+        random = global_random
+    hand_size_by_player = hand_sizes(state)
+    cards = unseen_cards(state)
+    random.shuffle(cards)
+
+    problem = Problem()
+    for player in range(4):
+        if state.hands[player]:
+            for card_index, card in enumerate(state.hands[player]):
+                problem.addVariable((player, card_index),
+                                    [card])
+        else:
+            voids_by_player = state.voids_by_player[player]
+            for card_index in range(hand_size_by_player[player]):
+                if voids_by_player:
+                    potential_cards = potential_cards_given_voids(
+                        state.trump, voids_by_player, cards)
+                    random.shuffle(potential_cards)
+                    problem.addVariable((player, card_index),
+                                        potential_cards)
+                else:
+                    problem.addVariable((player, card_index), cards)
+    problem.addConstraint(AllDifferentConstraint())
+
+    cards = sorted(iteritems(problem.getSolution()))
+    hands = [[], [], [], []]
+    for player in range(4):
+        hands[player] = [c[1] for c in cards[:hand_size_by_player[player]]]
+        del cards[:hand_size_by_player[player]]
+
+    return state._replace(hands=hands)
 
 
 class EuchreGame(object):
@@ -117,7 +346,9 @@ class EuchreGame(object):
                         'voids_by_player'])
 
     @classmethod
-    def initial_state(cls, visible_hand=None, trump_card=None):
+    def initial_state(cls, visible_hand=None, trump_card=None, random=None):
+        if random is None:
+            random = global_random
         all_cards = deal()
         if visible_hand is None:
             visible_hand = []
@@ -125,7 +356,7 @@ class EuchreGame(object):
             if card not in all_cards:
                 raise ValueError('Invalid starting hand')
         if trump_card is None:
-            trump_card = choice(all_cards)
+            trump_card = random.choice(all_cards)
         trump = trump_card[1]
         if trump not in suits:
             raise ValueError('Invalid trump suit')
@@ -144,17 +375,19 @@ class EuchreGame(object):
     def apply_move(cls, state, move):
         cards_played_by_player = state.cards_played_by_player[:]
         voids_by_player = state.voids_by_player
-        hands = [hand[:] for hand in state.hands]
+        # only the hand of the current player changes, the others are shared
+        hands = state.hands[:]
         tricks_won_by_team = state.tricks_won_by_team
         lead_card = state.lead_card
         cards_played = state.cards_played[:]
+        suit_by_card = effective_suits[state.trump]
 
         if state.lead_card is None:
             lead_card = move
 
-        lead_suit = suit(state.trump, lead_card)
-        if (suit(state.trump, move) in
-                state.voids_by_player[state.current_player]):
+        lead_suit = suit_by_card.get(lead_card)
+        move_suit = suit_by_card.get(move)
+        if move_suit in state.voids_by_player[state.current_player]:
             raise ValueError('Did not follow suit voids_by_player=%r move=%r '
                              'hand=%r' % (state.voids_by_player, move,
                                           state.hands[state.current_player]))
@@ -170,21 +403,18 @@ class EuchreGame(object):
                               move))
         cards_played_by_player[state.current_player] = move
         cards_played.append(move)
+        hands[state.current_player] = hands[state.current_player][:]
         hands[state.current_player].remove(move)
 
-        if lead_suit != suit(state.trump, move):
+        if lead_suit != move_suit:
             voids_by_player = [set(x) for x in state.voids_by_player]
             voids_by_player[state.current_player].add(lead_suit)
 
         next_player = (state.current_player + 1) % 4
 
-        number_of_cards_played = len(
-            list(filter(None, cards_played_by_player)))
-
-        if number_of_cards_played == 4:
-            winner = winning_card(state.trump,
-                                  lead_suit,
-                                  cards_played_by_player)
+        if None not in cards_played_by_player:
+            winner = max(cards_played_by_player,
+                         key=ranks[state.trump][lead_suit].__getitem__)
             winning_player = cards_played_by_player.index(winner)
             tricks_won_by_team = tricks_won_by_team[:]
             winning_team = team[winning_player]
@@ -219,48 +449,37 @@ class EuchreGame(object):
     def get_moves(state):
         return (False,
                 playable_cards(state.trump,
-                               suit(state.trump, state.lead_card),
+                               effective_suits[state.trump].get(
+                                   state.lead_card),
                                state.hands[state.current_player]))
 
+    @classmethod
+    def determine(cls, state, random=None):
+        return cls.determinization_sampler(state, random)()
+
     @staticmethod
-    def determine(state):
-        card_played_this_round = [card is not None and 1 or 0
-                                  for card in state.cards_played_by_player]
-        remaining_hand_size = 5 - sum(state.tricks_won_by_team)
-        hand_size_by_player = [remaining_hand_size - played
-                               for played in card_played_this_round]
-        cards = list(set(deal()) -
-                     set(list(chain(*state.hands))) -
-                     set(state.cards_played))
-        shuffle(cards)
-
-        problem = Problem()
-        for player in range(4):
-            if state.hands[player]:
-                for card_index, card in enumerate(state.hands[player]):
-                    problem.addVariable((player, card_index),
-                                        [card])
-            else:
-                voids_by_player = state.voids_by_player[player]
-                for card_index in range(hand_size_by_player[player]):
-                    if voids_by_player:
-                        potential_cards = potential_cards_given_voids(
-                            state.trump, voids_by_player, cards)
-                        shuffle(potential_cards)
-                        problem.addVariable((player, card_index),
-                                            potential_cards)
-                    else:
-                        problem.addVariable((player, card_index), cards)
-        problem.addConstraint(AllDifferentConstraint())
-
-        cards = sorted(iteritems(problem.getSolution()))
-        hands = [[], [], [], []]
-        for player in range(4):
-            hands[player] = [c[1] for c in cards[:hand_size_by_player[player]]]
-            del cards[:hand_size_by_player[player]]
-
-        state = state._replace(hands=hands)
-        return state
+    def determinization_sampler(state, random=None):
+        """Works out the unseen cards, hand sizes and the cards every player
+        can hold once for all the determinizations of state"""
+        if random is None:
+            random = global_random
+        deal_hands = hidden_hands_dealer(state.trump,
+                                         state.hands,
+                                         hand_sizes(state),
+                                         state.voids_by_player,
+                                         unseen_cards(state))
+
+        def sample():
+            return state._replace(hands=deal_hands(random))
+        return sample
+
+    @staticmethod
+    def visible_state(state):
+        """The state as seen by the player to move: the other hands are
+        hidden"""
+        return state._replace(hands=[
+            hand if player == state.current_player else []
+            for player, hand in enumerate(state.hands)])
 
     @staticmethod
     def get_winner(state):
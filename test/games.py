@@ -198,6 +198,10 @@ class TicTacToeGame(object):
         return (False, [i for i, spot in enumerate(state.board)
                         if spot is None])
 
+    @staticmethod
+    def state_key(state):
+        return tuple(state.board)
+
     @staticmethod
     def get_winner(state):
         return state.winner
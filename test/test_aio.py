@@ -0,0 +1,86 @@
+import unittest
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from mittmcts import aio
+except (ImportError, SyntaxError):  # Python 2
+    aio = None
+
+from mittmcts import MCTS
+from test.games import TicTacToeGame
+
+
+@unittest.skipIf(aio is None, 'asyncio needs Python 3.5 or later')
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_get_simulation_result(self):
+        result = self.run_until_complete(
+            aio.get_simulation_result(MCTS(TicTacToeGame, seed=3), 200,
+                                      slice_iterations=7))
+        expected = MCTS(TicTacToeGame, seed=3).get_simulation_result(200)
+        self.assertEqual(result.root.visits, 200)
+        self.assertEqual(
+            [(child.move, child.visits) for child in result.root.children],
+            [(child.move, child.visits) for child in expected.root.children])
+
+    def test_searches_share_the_event_loop(self):
+        slices = []
+
+        def counting(search):
+            run = search.run
+
+            def counted_run(*args):
+                slices.append(search)
+                return run(*args)
+            search.run = counted_run
+            return search
+
+        searches = [counting(MCTS(TicTacToeGame).search(100))
+                    for _ in range(2)]
+        results = self.run_until_complete(asyncio.gather(
+            *[aio.run(search, slice_iterations=10) for search in searches]))
+        self.assertEqual([result.root.visits for result in results],
+                         [100, 100])
+        # the slices of the two searches are interleaved
+        self.assertEqual(slices[:4], searches * 2)
+
+    def test_deadline(self):
+        result = self.run_until_complete(
+            aio.get_simulation_result(MCTS(TicTacToeGame), max_seconds=0.05))
+        self.assertTrue(result.root.visits > 0)
+
+    def test_cancellation(self):
+        search = MCTS(TicTacToeGame).search()
+        task = self.loop.create_task(aio.run(search, slice_iterations=10))
+        self.loop.call_later(0.02, task.cancel)
+        with self.assertRaises(asyncio.CancelledError):
+            self.run_until_complete(task)
+        self.assertTrue(search.cancelled)
+        self.assertTrue(search.plays > 0)
+
+    def test_executor(self):
+        with ThreadPoolExecutor(1) as executor:
+            result = self.run_until_complete(
+                aio.get_simulation_result(MCTS(TicTacToeGame), 100,
+                                          executor=executor))
+        self.assertEqual(result.root.visits, 100)
+
+    def test_cancellation_with_executor(self):
+        search = MCTS(TicTacToeGame).search()
+        with ThreadPoolExecutor(1) as executor:
+            task = self.loop.create_task(aio.run(search, executor=executor))
+            self.loop.call_later(0.02, task.cancel)
+            with self.assertRaises(asyncio.CancelledError):
+                self.run_until_complete(task)
+        self.assertTrue(search.cancelled)
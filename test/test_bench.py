@@ -0,0 +1,52 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mittmcts.bench import (
+    main, run_benchmark, run_determinization_benchmark, run_thread_benchmark
+)
+
+
+class TestBench(unittest.TestCase):
+    def test_run_benchmark(self):
+        result = run_benchmark('tictactoe', 'rollout', iterations=50, seed=1)
+        self.assertEqual(result['iterations'], 50)
+        self.assertEqual(result['nodes'], 51)
+        self.assertGreater(result['iterations_per_second'], 0)
+        self.assertGreaterEqual(result['max_depth'], result['avg_depth'])
+        self.assertEqual(run_benchmark('tictactoe', 'tree', 50, 1)['nodes'],
+                         run_benchmark('tictactoe', 'tree', 50, 1)['nodes'])
+
+    def test_main_writes_json(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'bench.json')
+            main(['--games', 'dice', 'connect4', '--engines', 'compact',
+                  '--iterations', '20', '--json', path])
+            with open(path) as output:
+                results = json.load(output)['results']
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([(result['game'], result['engine'])
+                          for result in results],
+                         [('dice', 'compact'), ('connect4', 'compact')])
+        self.assertEqual(results[1]['nodes'], 21)
+
+    def test_run_determinization_benchmark(self):
+        results = run_determinization_benchmark(count=5)
+        self.assertEqual([(result['state'], result['implementation'])
+                          for result in results],
+                         [('start', 'sampler'), ('start', 'csp'),
+                          ('voids', 'sampler'), ('voids', 'csp')])
+        self.assertTrue(all(result['determinizations_per_second'] > 0
+                            for result in results))
+
+    def test_run_thread_benchmark(self):
+        results = run_thread_benchmark('tictactoe', iterations=50,
+                                       thread_counts=[1, 2])
+        self.assertEqual([result['threads'] for result in results], [1, 2])
+        self.assertEqual(results[0]['speedup'], 1.0)
+        self.assertTrue(all(result['iterations_per_second'] > 0
+                            for result in results))
@@ -0,0 +1,77 @@
+import unittest
+
+from mittmcts.compact import CompactMCTS, CompactTree, NO_NODE
+
+from test.euchre import EuchreGame
+from test.games import GameWithTwoMoves, SimpleDiceRollingGame, TicTacToeGame
+
+
+class TestCompactTree(unittest.TestCase):
+    def test_add_node_links_siblings(self):
+        tree = CompactTree()
+        first = tree.add_node(0, 'a')
+        second = tree.add_node(0, 'b')
+        grandchild = tree.add_node(first, 'a')
+        self.assertEqual(len(tree), 4)
+        self.assertEqual(list(tree.children(0)), [second, first])
+        self.assertEqual(tree.children_by_move(first), {'a': grandchild})
+        self.assertEqual(tree.parent[grandchild], first)
+        self.assertEqual(tree.parent[0], NO_NODE)
+        self.assertEqual(tree.move_id[first], tree.move_id[grandchild])
+
+    def test_backprop_counts_wins_and_draws(self):
+        tree = CompactTree()
+        child = tree.add_node(0, 'a')
+        tree.backprop(child, 'X')
+        tree.add_node(0, 'b')
+        tree.backprop(child, 'O')
+        self.assertEqual(list(tree.visits), [2, 2, 0])
+        self.assertEqual(list(tree.wins('X')), [1, 1, 0])
+        self.assertEqual(list(tree.wins('O')), [1, 1, 0])
+        self.assertEqual(list(tree.draws), [0, 0, 0])
+
+
+class TestCompactMCTS(unittest.TestCase):
+    def test_game_with_two_possible_moves(self):
+        result = CompactMCTS(GameWithTwoMoves).get_simulation_result(100)
+        self.assertEqual(result.move, 1)
+        self.assertEqual(result.root.visits, 100)
+        self.assertEqual(result.max_depth, 2)
+        self.assertEqual(len(result.root.tree), 4)
+        child = result.root.most_visited_child()
+        self.assertEqual(child.wins_by_player, {1: child.visits})
+
+    def test_one_node_per_iteration(self):
+        result = CompactMCTS(TicTacToeGame).get_simulation_result(200)
+        self.assertEqual(len(result.root.tree), 201)
+        self.assertEqual(sum(child.visits for child in result.root.children),
+                         200)
+
+    def test_max_nodes(self):
+        result = (CompactMCTS(TicTacToeGame, max_nodes=50)
+                  .get_simulation_result(200))
+        self.assertEqual(len(result.root.tree), 50)
+        self.assertEqual(result.root.visits, 200)
+
+    def test_selects_winning_tictactoe_move(self):
+        ___ = None
+        one_move_from_winning = TicTacToeGame.State(board=['O', ___, ___,
+                                                           'O', 'X', 'X',
+                                                           ___, 'X', ___],
+                                                    current_player='O',
+                                                    winner=None)
+        result = (CompactMCTS(TicTacToeGame, one_move_from_winning)
+                  .get_simulation_result(100))
+        self.assertEqual(result.move, 6)
+        self.assertEqual(result.root.most_visited_child().state.winner, 'O')
+
+    def test_random_moves(self):
+        result = CompactMCTS(SimpleDiceRollingGame).get_simulation_result(200)
+        self.assertEqual(result.move, 2)
+
+    def test_euchre_determinizations(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        result = (CompactMCTS(EuchreGame, state)
+                  .get_simulation_result(100, ['0d', 'as']))
+        self.assertIn(result.move, ['0d', 'as'])
+        self.assertEqual(result.avg_depth, 20)
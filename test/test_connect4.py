@@ -1,10 +1,10 @@
 from time import time
 import unittest
 
-from mittmcts import MCTS
-
+from mittmcts import MCTS, Draw
 from test.connect4 import (
-    get_bitboards, find_row_for_column, empty_board, ConnectFourGame
+    get_bitboards, get_board, empty_board, count_pairs, full_mask,
+    ConnectFourGame
 )
 
 
@@ -19,22 +19,6 @@ class TestConnectFour(unittest.TestCase):
                           [_, _, _, _, _, _, _],
                           [_, _, _, _, _, _, _]])
 
-    def test_find_row_for_column(self):
-        _ = None
-        board = [[0, 0, _, _, _, 1, 1],
-                 [1, 0, _, _, _, 0, 0],
-                 [0, 1, 0, _, _, 1, 1],
-                 [1, 0, 1, _, _, 0, 0],
-                 [0, 1, 0, _, _, 1, 1],
-                 [1, 0, 1, _, 1, 0, 0]]
-        self.assertEqual(find_row_for_column(board, 2), 1)
-        with self.assertRaises(Exception):
-            find_row_for_column(board, 0)
-        self.assertEqual(find_row_for_column(board, 3), 5)
-        self.assertEqual(find_row_for_column(board, 4), 4)
-        with self.assertRaises(Exception):
-            find_row_for_column(board, 5)
-
     def test_apply_move(self):
         _ = None
         board = [[_, _, _, _, _, _, _],
@@ -43,12 +27,10 @@ class TestConnectFour(unittest.TestCase):
                  [_, _, _, _, _, _, _],
                  [_, _, _, _, _, _, _],
                  [_, _, _, _, 0, 0, 0]]
-        initial_state = ConnectFourGame.initial_state()
-        initial_state = initial_state._replace(board=board,
-                                               bitboards=get_bitboards(board))
+        initial_state = ConnectFourGame.from_board(board)
         state = ConnectFourGame.apply_move(initial_state, 6)
         self.assertIsNone(state.winner)
-        self.assertEqual(state.board,
+        self.assertEqual(ConnectFourGame.board(state),
                          [[_, _, _, _, _, _, _],
                           [_, _, _, _, _, _, _],
                           [_, _, _, _, _, _, _],
@@ -56,7 +38,7 @@ class TestConnectFour(unittest.TestCase):
                           [_, _, _, _, _, _, 0],
                           [_, _, _, _, 0, 0, 0]])
         state = ConnectFourGame.apply_move(initial_state, 3)
-        self.assertEqual(state.board,
+        self.assertEqual(ConnectFourGame.board(state),
                          [[_, _, _, _, _, _, _],
                           [_, _, _, _, _, _, _],
                           [_, _, _, _, _, _, _],
@@ -72,13 +54,45 @@ class TestConnectFour(unittest.TestCase):
                  [_, _, _, _, _, 1, 0],
                  [_, _, _, _, 1, 0, 1],
                  [_, _, _, 1, 0, 0, 0]]
-        state = ConnectFourGame.initial_state()
-        state = state._replace(board=board,
-                               bitboards=get_bitboards(board),
-                               current_player=1)
+        state = ConnectFourGame.from_board(board, current_player=1)
         state = ConnectFourGame.apply_move(state, 6)
         self.assertEqual(state.winner, 1)
 
+    def test_board_round_trip(self):
+        _ = None
+        board = [[_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, 1, 0],
+                 [_, _, _, _, 1, 0, 1],
+                 [_, _, _, 1, 0, 0, 0]]
+        self.assertEqual(get_board(get_bitboards(board)), board)
+        self.assertEqual(ConnectFourGame.board(
+            ConnectFourGame.initial_state()), empty_board())
+
+    def test_get_moves_skips_full_columns(self):
+        state = ConnectFourGame.initial_state()
+        for _ in range(6):
+            state = ConnectFourGame.apply_move(state, 2)
+        self.assertEqual(ConnectFourGame.get_moves(state),
+                         (False, [0, 1, 3, 4, 5, 6]))
+        with self.assertRaises(ValueError):
+            ConnectFourGame.apply_move(state, 2)
+
+    def test_full_board_is_a_draw(self):
+        _ = None
+        board = [[0, 1, 1, 0, 0, 1, _],
+                 [0, 0, 0, 1, 0, 0, 0],
+                 [0, 1, 0, 1, 1, 1, 0],
+                 [1, 1, 0, 1, 1, 0, 0],
+                 [1, 0, 1, 0, 1, 0, 1],
+                 [1, 0, 1, 0, 0, 1, 1]]
+        state = ConnectFourGame.from_board(board, current_player=1)
+        self.assertIsNone(state.winner)
+        state = ConnectFourGame.apply_move(state, 6)
+        self.assertEqual(state.winner, Draw)
+        self.assertEqual(ConnectFourGame.get_moves(state), (False, []))
+
     def test_with_mcts(self):
         _ = None
         board = [[_, _, _, _, _, _, _],
@@ -87,13 +101,73 @@ class TestConnectFour(unittest.TestCase):
                  [_, _, _, _, _, _, _],
                  [_, _, 1, 1, 1, _, _],
                  [_, _, 0, 0, 0, _, _]]
-        state = ConnectFourGame.State(
-            board=board,
-            current_player=0,
-            bitboards=get_bitboards(board),
-            winner=None)
+        state = ConnectFourGame.from_board(board)
         start_time = time()
         result = (MCTS(ConnectFourGame, state)
                   .get_simulation_result(max_seconds=1))
         self.assertGreater(time() - start_time, 1)
         self.assertIn(result.move, [1, 5])
+
+    def test_solver(self):
+        _ = None
+        board = [[_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [1, 1, 1, _, _, _, _],
+                 [0, 0, 0, _, _, _, _]]
+        state = ConnectFourGame.from_board(board)
+        result = (MCTS(ConnectFourGame, state, solver=True, rollout=True)
+                  .get_simulation_result(10000))
+        self.assertEqual(result.move, 3)
+        self.assertEqual(result.root.proven, 0)
+        self.assertTrue(result.iterations_saved > 9900)
+
+        # every move but blocking the three in a row is a proven loss
+        board = [[_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, 0, _],
+                 [1, 1, 1, _, _, 0, 0]]
+        state = ConnectFourGame.from_board(board)
+        result = (MCTS(ConnectFourGame, state, solver=True)
+                  .get_simulation_result(1000))
+        self.assertEqual(result.move, 3)
+        self.assertEqual(set(child.proven for child in result.root.children
+                             if child.move != 3),
+                         set([1]))
+
+    def test_evaluator(self):
+        _ = None
+        board = [[_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, _, _],
+                 [_, _, _, _, _, 0, _],
+                 [1, 1, 1, _, _, 0, 0]]
+        state = ConnectFourGame.from_board(board)
+        (values, priors), = ConnectFourGame.evaluate([state])
+        self.assertAlmostEqual(values[0] + values[1], 1)
+        self.assertEqual(max(priors, key=priors.get), 3)
+        result = (MCTS(ConnectFourGame, state,
+                       evaluator=ConnectFourGame.evaluate, batch_size=8)
+                  .get_simulation_result(1000))
+        self.assertEqual(result.move, 3)
+
+    def test_pairs_with_room_above_or_to_the_right(self):
+        state = ConnectFourGame.initial_state()
+        for move in [0, 6, 1, 6]:
+            state = ConnectFourGame.apply_move(state, move)
+        bitboards = state.bitboards
+        empty = full_mask & ~(bitboards[0] | bitboards[1])
+        # a pair across the bottom with room to the right and a pair up
+        # the last column with room above
+        self.assertEqual(count_pairs(bitboards[0], empty), 1)
+        self.assertEqual(count_pairs(bitboards[1], empty), 1)
+        state = ConnectFourGame.initial_state()
+        for move in [0, 6, 1]:
+            state = ConnectFourGame.apply_move(state, move)
+        (values, _), = ConnectFourGame.evaluate([state])
+        self.assertTrue(values[0] > 0.5)
+        self.assertAlmostEqual(values[0] + values[1], 1)
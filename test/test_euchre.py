@@ -1,12 +1,16 @@
+from collections import Counter
 from itertools import chain
+from random import Random
 import unittest
 
+from mock import patch
+
 from mittmcts import MCTS
 
 from test.euchre import (
     second_highest_jack, winning_card, deal, sort_by_trump_and_lead,
-    playable_cards, suit, potential_cards_given_voids,
-    EuchreGame
+    playable_cards, suit, potential_cards_given_voids, deal_hidden_hands,
+    determine_with_csp, EuchreGame
 )
 
 
@@ -218,3 +222,153 @@ class TestEuchre(unittest.TestCase):
         state = EuchreGame.initial_state()
         state = EuchreGame.determine(state)
         self.assertTrue(all(len(hand) == 5 for hand in state.hands))
+
+    def test_with_mcts_root_parallel(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        result = (MCTS(EuchreGame, state)
+                  .get_simulation_result(100, ['0d', 'as'], processes=2))
+        self.assertIn(result.move, ['0d', 'as'])
+        self.assertEqual(result.root.visits, 100)
+        self.assertEqual(result.avg_depth, 20)
+
+    def counted_sampler(self, samples):
+        sampler = EuchreGame.determinization_sampler
+
+        def counted(state):
+            sample = sampler(state)
+
+            def counted_sample():
+                samples.append(None)
+                return sample()
+            return counted_sample
+        return patch.object(EuchreGame, 'determinization_sampler',
+                            side_effect=counted)
+
+    def test_determinizations_are_sampled_up_front(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        samples = []
+        with self.counted_sampler(samples):
+            result = (MCTS(EuchreGame, state)
+                      .get_simulation_result(100, determinizations=5))
+        self.assertEqual(len(samples), 5)
+        self.assertEqual(result.root.visits, 100)
+        self.assertEqual(result.avg_depth, 20)
+
+    def test_determinization_sampler_is_prepared_once_per_search(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        samples = []
+        with self.counted_sampler(samples) as sampler:
+            MCTS(EuchreGame, state).get_simulation_result(50)
+            self.assertEqual(sampler.call_count, 1)
+        self.assertEqual(len(samples), 50)
+
+    def test_determinization_sampler(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        state = state._replace(
+            voids_by_player=[set(), set(['d', 'h']), set(), set(['s'])])
+        sample = EuchreGame.determinization_sampler(state, Random(1))
+        for _ in range(20):
+            hands = sample().hands
+            self.assertEqual(hands[0], ['0d', '0h', 'as', 'ac', 'ah'])
+            self.assertEqual(len(set(chain(*hands))), 20)
+            self.assertFalse(set(hands[1]) & set(['9d', 'qd', 'kh', 'jh']))
+            self.assertFalse(set(hands[3]) & set(['9s', 'qs', 'ks', 'js']))
+
+    def test_prefetched_determinizations(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        results = [MCTS(EuchreGame, state, seed=3, prefetch=32)
+                   .get_simulation_result(100)
+                   for _ in range(2)]
+        self.assertEqual(results[0].root.visits, 100)
+        self.assertEqual(results[0].avg_depth, 20)
+        self.assertEqual(
+            [(child.move, child.visits) for child in results[0].root.children],
+            [(child.move, child.visits) for child in results[1].root.children])
+
+    def test_with_mcts_determinization_parallel(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        result = (MCTS(EuchreGame, state)
+                  .get_simulation_result(100, ['0d', 'as'],
+                                         processes=2,
+                                         determinizations=10))
+        self.assertIn(result.move, ['0d', 'as'])
+        self.assertEqual(result.root.visits, 100)
+
+    def test_seeded_searches_are_reproducible(self):
+        state = EuchreGame.initial_state(['0d', '0h', 'as', 'ac', 'ah'], 'jd')
+        first = MCTS(EuchreGame, state, seed=3).get_simulation_result(50)
+        second = MCTS(EuchreGame, state, seed=3).get_simulation_result(50)
+        self.assertEqual(
+            [(child.move, child.visits) for child in first.root.children],
+            [(child.move, child.visits) for child in second.root.children])
+        self.assertEqual(EuchreGame.initial_state(random=Random(1)),
+                         EuchreGame.initial_state(random=Random(1)))
+
+    def test_determine_with_csp_respects_voids(self):
+        state = EuchreGame.initial_state()
+        state = state._replace(trump_card='jd',
+                               trump='d',
+                               cards_played=['jd', 'ad', 'kd', 'qd', 'qc'],
+                               tricks_won_by_team=[1, 0],
+                               hands=[['jc', 'kc', 'ah', 'js'], [], [], []],
+                               voids_by_player=[set(),
+                                                set(['d', 'h', 'c']),
+                                                set(),
+                                                set(['s', 'c', 'd'])])
+        for determine in [EuchreGame.determine, determine_with_csp]:
+            hands = determine(state).hands
+            self.assertEqual([len(hand) for hand in hands], [4, 4, 4, 4])
+            self.assertEqual(len(set(chain(*hands))), 16)
+            self.assertTrue(all(suit('d', card) == 's'
+                                for card in hands[1]))
+            self.assertTrue(all(suit('d', card) == 'h'
+                                for card in hands[3]))
+
+    def test_deal_hidden_hands_reaches_every_card(self):
+        cards = ['ad', 'kd', 'as', 'ks']
+        seen = [set(), set()]
+        rng = Random(0)
+        for _ in range(100):
+            hands = deal_hidden_hands('c', [[], [], ['9c'], []], [2, 2, 1, 0],
+                                      [set(), set(), set(), set()],
+                                      cards, rng)
+            self.assertEqual(hands[2:], [['9c'], []])
+            self.assertEqual(sorted(hands[0] + hands[1]), sorted(cards))
+            seen[0].update(hands[0])
+            seen[1].update(hands[1])
+        self.assertEqual(seen, [set(cards), set(cards)])
+
+    def test_deal_hidden_hands_is_uniform(self):
+        # player 0 cannot hold hearts and player 1 cannot hold diamonds,
+        # which leaves three deals
+        for shuffles in [0, 20]:
+            rng = Random(0)
+            deals = Counter(
+                tuple(tuple(hand) for hand in deal_hidden_hands(
+                    'c', [[], [], [], ['9c']], [1, 1, 1, 0],
+                    [set(['h']), set(['d']), set(), set()],
+                    ['ad', 'as', 'ah'], rng, shuffles))
+                for _ in range(6000))
+            self.assertEqual(set(deals), set([
+                (('ad',), ('as',), ('ah',), ('9c',)),
+                (('ad',), ('ah',), ('as',), ('9c',)),
+                (('as',), ('ah',), ('ad',), ('9c',))]))
+            for count in deals.values():
+                self.assertAlmostEqual(count / 6000.0, 1 / 3.0, delta=0.03)
+
+    def test_dealing_leaves_cards_over_uniformly(self):
+        rng = Random(1)
+        kept = Counter()
+        for _ in range(4000):
+            hands = deal_hidden_hands('c', [[], [], [], []], [1, 0, 0, 0],
+                                      [set(['h']), set(), set(), set()],
+                                      ['ad', 'as', 'ah'], rng, shuffles=0)
+            kept.update(hands[0])
+        self.assertEqual(set(kept), set(['ad', 'as']))
+        self.assertAlmostEqual(kept['ad'] / 4000.0, 0.5, delta=0.03)
+
+    def test_deal_hidden_hands_fails_when_voids_cannot_be_met(self):
+        with self.assertRaises(ValueError):
+            deal_hidden_hands('c', [[], [], [], []], [2, 0, 0, 0],
+                              [set(['d']), set(), set(), set()],
+                              ['ad', 'kd', 'as'], Random(0))
@@ -1,12 +1,28 @@
+from random import Random
 import unittest
 
 from mock import patch
+from six import StringIO
 
 from test.games import (
     GameWithOneMove, GameWithTwoMoves, SimpleDiceRollingGame, TicTacToeGame,
     GameWithManyMovesOnlyOneDetermined
 )
-from mittmcts import MCTS, Draw
+from mittmcts import (
+    MCTS, Draw, DeterminizationQueue, Profile, Snapshot, TranspositionTable,
+    flamegraph, tree_size
+)
+
+
+class ThreadedTicTacToeGame(TicTacToeGame):
+    """Says it releases the GIL so searches use their threads"""
+    releases_gil = True
+
+
+def visited_nodes(node):
+    """Counts the nodes in the tree under node that have been played out"""
+    return 1 + sum(visited_nodes(child) for child in node.children
+                   if child.visits)
 
 
 class TestMCTS(unittest.TestCase):
@@ -33,7 +49,7 @@ class TestMCTS(unittest.TestCase):
         self.assertEqual(result.avg_depth, 1.06)
 
     def test_random_moves_selected_randomly(self):
-        with patch('mittmcts.choice') as mock_choice:
+        with patch('random.choice') as mock_choice:
             # always choose the first item in random choices
             # (lowest die rolls in our silly game)
             mock_choice.side_effect = lambda items: items[0]
@@ -58,7 +74,7 @@ class TestMCTS(unittest.TestCase):
                              2)
             self.assertEqual(result.root.wins_by_player[1], 0)
 
-        with patch('mittmcts.choice') as mock_choice:
+        with patch('random.choice') as mock_choice:
             mock_choice.side_effect = lambda items: items[-1]
             result = MCTS(SimpleDiceRollingGame).get_simulation_result(100)
             # 100 simulations should be enough time for UCB1 to converge on
@@ -114,3 +130,746 @@ class TestMCTS(unittest.TestCase):
                   .get_simulation_result(100))
         self.assertEqual(result.root.children[0].move, 1)
         self.assertEqual(result.root.children[0].visits, 100)
+
+    def test_rollout_adds_one_node_per_iteration(self):
+        result = (MCTS(TicTacToeGame, rollout=True)
+                  .get_simulation_result(50))
+        self.assertEqual(visited_nodes(result.root), 51)
+        self.assertEqual(result.root.visits, 50)
+        self.assertGreaterEqual(result.max_depth, 5)
+
+    def test_rollout_selects_winning_tictactoe_move(self):
+        ___ = None
+        one_move_from_winning = TicTacToeGame.State(board=['O', 'O', ___,
+                                                           'X', ___, 'X',
+                                                           ___, 'X', ___],
+                                                    current_player='O',
+                                                    winner=None)
+        result = (MCTS(TicTacToeGame, one_move_from_winning, rollout=True)
+                  .get_simulation_result(100))
+        self.assertEqual(result.move, 2)
+
+    def test_rollout_game_with_two_possible_moves(self):
+        result = (MCTS(GameWithTwoMoves, rollout=True)
+                  .get_simulation_result(100))
+        self.assertEqual(result.move, 1)
+        self.assertEqual(result.root.visits, 100)
+
+    def test_rollout_policy_is_used_for_rollouts(self):
+        with patch.object(TicTacToeGame, 'rollout_policy', create=True) \
+                as rollout_policy:
+            rollout_policy.side_effect = lambda state, moves: moves[0]
+            MCTS(TicTacToeGame, rollout=True).get_simulation_result(10)
+            self.assertTrue(rollout_policy.called)
+            for call_args in rollout_policy.call_args_list:
+                state, moves = call_args[0]
+                self.assertEqual(
+                    moves, TicTacToeGame.get_moves(state)[1])
+
+    def test_rollout_random_moves_keep_misc(self):
+        result = (MCTS(SimpleDiceRollingGame, rollout=True)
+                  .get_simulation_result(100))
+        self.assertEqual(result.root.visits, 100)
+        self.assertEqual(result.root.misc_by_player[1]['min_score'], 0)
+        self.assertEqual(result.move, 2)
+
+    def test_root_parallel_merges_root_children(self):
+        ___ = None
+        one_move_from_winning = TicTacToeGame.State(board=['O', 'O', ___,
+                                                           'X', ___, 'X',
+                                                           ___, 'X', ___],
+                                                    current_player='O',
+                                                    winner=None)
+        result = (MCTS(TicTacToeGame, one_move_from_winning)
+                  .get_simulation_result(101, processes=2))
+        self.assertEqual(result.move, 2)
+        self.assertEqual(result.root.visits, 101)
+        self.assertEqual(sum(child.visits for child in result.root.children),
+                         101)
+        self.assertEqual(result.leaf_nodes, [])
+
+    def test_root_parallel_game_with_two_possible_moves(self):
+        result = (MCTS(GameWithTwoMoves)
+                  .get_simulation_result(100, processes=3))
+        self.assertEqual(result.move, 1)
+        self.assertEqual(result.max_depth, 2)
+        self.assertEqual(result.root.children[1].wins_by_player,
+                         {1: result.root.children[1].visits})
+
+    def test_root_parallel_does_not_collect_leaf_nodes(self):
+        with self.assertRaises(ValueError):
+            (MCTS(GameWithTwoMoves)
+             .get_simulation_result(100, get_leaf_nodes=True, processes=2))
+
+    def test_only_determined_moves_are_followed_with_determinizations(self):
+        result = (MCTS(GameWithManyMovesOnlyOneDetermined)
+                  .get_simulation_result(100, determinizations=3))
+        self.assertEqual(result.root.children[0].move, 1)
+        self.assertEqual(result.root.children[0].visits, 100)
+
+    def test_determinizations_require_determine(self):
+        with self.assertRaises(ValueError):
+            (MCTS(GameWithTwoMoves)
+             .get_simulation_result(100, determinizations=3))
+
+    def test_determinization_queue(self):
+        samples = iter(range(100))
+        queue = DeterminizationQueue(lambda: next(samples), 10, batch_size=4)
+        try:
+            self.assertEqual([next(queue) for _ in range(10)],
+                             list(range(10)))
+        finally:
+            queue.close()
+        self.assertFalse(queue.thread.is_alive())
+
+    def test_determinization_queue_raises_sampler_errors(self):
+        def sampler():
+            raise ValueError('no consistent deal')
+        queue = DeterminizationQueue(sampler, 10)
+        try:
+            with self.assertRaises(ValueError):
+                next(queue)
+        finally:
+            queue.close()
+
+    def test_prefetch_determinizations(self):
+        result = (MCTS(GameWithManyMovesOnlyOneDetermined, prefetch=8)
+                  .get_simulation_result(100))
+        self.assertEqual(result.root.visits, 100)
+        self.assertEqual(result.move, 1)
+
+    def test_advance_keeps_statistics_of_the_subtree(self):
+        mcts = MCTS(TicTacToeGame)
+        result = mcts.get_simulation_result(300)
+        move = result.move
+        child = result.root.most_visited_child()
+        reply = child.most_visited_child()
+        mcts.advance(move)
+        mcts.advance(reply.move)
+        visits = reply.visits
+        result = mcts.get_simulation_result(100)
+        self.assertIs(result.root, reply)
+        self.assertIsNone(result.root.parent)
+        self.assertEqual(result.root.visits, visits + 100)
+        self.assertEqual(result.root.state.board.count(None), 7)
+        self.assertLessEqual(result.max_depth, 7)
+
+    def test_advance_to_unexplored_move_starts_from_scratch(self):
+        mcts = MCTS(TicTacToeGame, rollout=True)
+        root = mcts.get_simulation_result(1).root
+        unexplored = [child.move for child in root.children
+                      if not child.visits][0]
+        mcts.advance(unexplored)
+        result = mcts.get_simulation_result(10)
+        self.assertEqual(result.root.visits, 10)
+        self.assertEqual(result.root.state.board.count(None), 8)
+
+    def test_transpositions_share_nodes(self):
+        result = (MCTS(TicTacToeGame, transpositions=10000)
+                  .get_simulation_result(200))
+        self.assertEqual(result.root.visits, 200)
+
+        def follow(node, moves):
+            for move in moves:
+                node.children
+                node = node.get_child(move)
+            return node
+
+        self.assertIs(follow(result.root, [0, 1, 2]),
+                      follow(result.root, [2, 1, 0]))
+        self.assertIsNot(follow(result.root, [0, 1, 2]),
+                         follow(result.root, [1, 0, 2]))
+        self.assertEqual(sum(child.visits for child in result.root.children),
+                         200)
+
+    def test_transpositions_select_winning_tictactoe_move(self):
+        ___ = None
+        one_move_from_winning = TicTacToeGame.State(board=['O', ___, ___,
+                                                           'O', 'X', 'X',
+                                                           ___, 'X', ___],
+                                                    current_player='O',
+                                                    winner=None)
+        for rollout in [False, True]:
+            result = (MCTS(TicTacToeGame, one_move_from_winning,
+                           rollout=rollout, transpositions=100)
+                      .get_simulation_result(100))
+            self.assertEqual(result.move, 6)
+
+    def test_transposition_table_evicts_least_recently_used(self):
+        table = TranspositionTable(2)
+        table.add('a', 1)
+        table.add('b', 2)
+        self.assertEqual(table.get('a'), 1)
+        table.add('c', 3)
+        self.assertEqual(len(table), 2)
+        self.assertIsNone(table.get('b'))
+        self.assertEqual(table.get('a'), 1)
+        self.assertEqual(table.get('c'), 3)
+
+    def test_transpositions_require_state_key(self):
+        with self.assertRaises(ValueError):
+            MCTS(GameWithTwoMoves, transpositions=100)
+        with self.assertRaises(ValueError):
+            MCTS(GameWithManyMovesOnlyOneDetermined, transpositions=100)
+
+    def test_moves_and_winner_are_memoized_per_node(self):
+        result = MCTS(TicTacToeGame).get_simulation_result(50)
+        with patch.object(TicTacToeGame, 'get_moves',
+                          side_effect=TicTacToeGame.get_moves) as get_moves, \
+                patch.object(TicTacToeGame, 'get_winner',
+                             side_effect=TicTacToeGame.get_winner) \
+                as get_winner:
+            for _ in range(3):
+                result.root.children
+                result.root.winner
+                result.root.most_visited_child()
+            self.assertEqual(get_moves.call_count, 0)
+            self.assertEqual(get_winner.call_count, 0)
+            child = result.root.most_visited_child()
+            child.reset_state()
+            child.children
+            child.winner
+            self.assertEqual(get_moves.call_count, 1)
+            self.assertEqual(get_winner.call_count, 1)
+
+    def test_seeded_searches_are_reproducible(self):
+        def stats(result):
+            return [(child.move, child.visits, dict(child.wins_by_player))
+                    for child in result.root.children]
+
+        for rollout in [False, True]:
+            first = (MCTS(TicTacToeGame, seed=42, rollout=rollout)
+                     .get_simulation_result(200))
+            second = (MCTS(TicTacToeGame, seed=Random(42), rollout=rollout)
+                      .get_simulation_result(200))
+            self.assertEqual(stats(first), stats(second))
+            self.assertEqual(first.avg_depth, second.avg_depth)
+
+    def test_seeded_parallel_searches_are_reproducible(self):
+        first = (MCTS(TicTacToeGame, seed=7)
+                 .get_simulation_result(100, processes=2))
+        second = (MCTS(TicTacToeGame, seed=7)
+                  .get_simulation_result(100, processes=2))
+        self.assertEqual([child.visits for child in first.root.children],
+                         [child.visits for child in second.root.children])
+
+    def test_search_snapshots(self):
+        with MCTS(TicTacToeGame, seed=1).search(100) as search:
+            snapshots = list(search.snapshots(every=30))
+        self.assertEqual([snapshot.iterations for snapshot in snapshots],
+                         [30, 60, 90, 100])
+        self.assertEqual([snapshot.done for snapshot in snapshots],
+                         [False, False, False, True])
+        last = snapshots[-1]
+        self.assertIsInstance(last, Snapshot)
+        self.assertEqual(sum(child.visits for child in last.children), 100)
+        self.assertEqual(last.move, last.children[0].move)
+        self.assertEqual(last.move, search.result().move)
+        for child in last.children:
+            self.assertTrue(0 <= child.win_rate <= 1)
+
+    def test_search_snapshots_match_a_blocking_search(self):
+        with MCTS(TicTacToeGame, seed=5).search(200) as search:
+            for _ in search.snapshots(every=7):
+                pass
+        result = MCTS(TicTacToeGame, seed=5).get_simulation_result(200)
+        self.assertEqual(
+            [(child.move, child.visits) for child in search.root.children],
+            [(child.move, child.visits) for child in result.root.children])
+
+    def test_search_can_be_cancelled(self):
+        with MCTS(TicTacToeGame).search() as search:
+            for snapshot in search.snapshots(every=10):
+                if snapshot.iterations >= 50:
+                    search.cancel()
+        self.assertTrue(search.done)
+        self.assertEqual(search.plays, 50)
+        self.assertEqual(search.result().root.visits, 50)
+
+    def test_search_can_be_extended(self):
+        with MCTS(TicTacToeGame).search(20) as search:
+            search.run()
+            self.assertTrue(search.done)
+            search.extend(iterations=30)
+            self.assertFalse(search.done)
+            self.assertEqual(search.run(), 30)
+        self.assertEqual(search.root.visits, 50)
+
+    def test_search_cannot_extend_a_budget_it_does_not_have(self):
+        with MCTS(TicTacToeGame).search(20) as search:
+            with self.assertRaises(ValueError):
+                search.extend(seconds=1)
+        with MCTS(TicTacToeGame).search(max_seconds=1) as search:
+            with self.assertRaises(ValueError):
+                search.extend(iterations=10)
+
+    def test_search_snapshots_every_seconds(self):
+        with MCTS(TicTacToeGame).search(max_seconds=0.2) as search:
+            snapshots = list(search.snapshots(every_seconds=0.01))
+        self.assertTrue(len(snapshots) > 1)
+        self.assertTrue(snapshots[-1].done)
+
+    def test_search_snapshots_need_an_interval(self):
+        with MCTS(TicTacToeGame).search(10) as search:
+            with self.assertRaises(ValueError):
+                next(search.snapshots())
+
+    def one_move_from_winning(self):
+        ___ = None
+        return TicTacToeGame.State(board=['O', 'O', ___,
+                                          'X', ___, 'X',
+                                          ___, 'X', ___],
+                                   current_player='O',
+                                   winner=None)
+
+    def test_early_stop(self):
+        result = (MCTS(TicTacToeGame, self.one_move_from_winning(), seed=0)
+                  .get_simulation_result(2000, early_stop=True))
+        self.assertEqual(result.move, 2)
+        self.assertTrue(result.iterations_saved > 0)
+        self.assertEqual(result.root.visits + result.iterations_saved, 2000)
+        children = sorted(result.root.children, key=lambda c: c.visits)
+        self.assertTrue(children[-1].visits - children[-2].visits >
+                        result.iterations_saved)
+
+    def test_early_stop_with_confidence(self):
+        ___ = None
+        # only playing 5 wins, the other moves let O win or draw
+        state = TicTacToeGame.State(board=['O', 'X', ___,
+                                           'X', 'X', ___,
+                                           'O', 'O', ___],
+                                    current_player='X',
+                                    winner=None)
+        result = (MCTS(TicTacToeGame, state, seed=0)
+                  .get_simulation_result(10000, confidence=3))
+        self.assertEqual(result.move, 5)
+        self.assertTrue(result.iterations_saved > 9000)
+
+    def test_no_iterations_are_saved_without_early_stop(self):
+        result = (MCTS(TicTacToeGame, self.one_move_from_winning())
+                  .get_simulation_result(100))
+        self.assertEqual(result.root.visits, 100)
+        self.assertEqual(result.iterations_saved, 0)
+
+    def test_parallel_searches_cannot_stop_early(self):
+        with self.assertRaises(ValueError):
+            (MCTS(TicTacToeGame)
+             .get_simulation_result(100, processes=2, early_stop=True))
+
+    def test_solver_returns_a_proven_win(self):
+        for rollout in [False, True]:
+            result = (MCTS(TicTacToeGame, self.one_move_from_winning(),
+                           solver=True, rollout=rollout)
+                      .get_simulation_result(1000))
+            self.assertEqual(result.move, 2)
+            self.assertEqual(result.root.proven, 'O')
+            self.assertTrue(result.root.visits < 10)
+            self.assertEqual(result.root.visits + result.iterations_saved,
+                             1000)
+
+    def test_solver_proves_a_draw(self):
+        ___ = None
+        state = TicTacToeGame.State(board=['X', 'O', 'X',
+                                           ___, 'O', ___,
+                                           ___, 'X', ___],
+                                    current_player='O',
+                                    winner=None)
+        result = (MCTS(TicTacToeGame, state, solver=True)
+                  .get_simulation_result(10000))
+        self.assertIs(result.root.proven, Draw)
+        self.assertIs(result.root.get_child(result.move).proven, Draw)
+        self.assertTrue(result.iterations_saved > 0)
+
+    def test_solver_does_not_search_solved_subtrees(self):
+        ___ = None
+        state = TicTacToeGame.State(board=['X', 'O', 'X',
+                                           ___, 'O', ___,
+                                           ___, 'X', ___],
+                                    current_player='O',
+                                    winner=None)
+        mcts = MCTS(TicTacToeGame, state, seed=2, solver=True)
+        with mcts.search() as search:
+            search.run(30)
+            solved = [(child, child.visits) for child in search.root.children
+                      if child.proven is not None]
+            self.assertTrue(solved)
+            search.run(30)
+        for child, visits in solved:
+            self.assertEqual(child.visits, visits)
+
+    def test_solver_requires_perfect_information(self):
+        with self.assertRaises(ValueError):
+            MCTS(GameWithManyMovesOnlyOneDetermined, solver=True)
+
+    def test_max_nodes(self):
+        for rollout in [False, True]:
+            result = (MCTS(TicTacToeGame, rollout=rollout, max_nodes=100)
+                      .get_simulation_result(1000))
+            self.assertEqual(result.root.visits, 1000)
+            # a node is expanded with all of its children at once
+            self.assertTrue(tree_size(result.root) <= 100 + 8)
+            self.assertEqual(result.root.budget.nodes,
+                             tree_size(result.root))
+
+    def test_max_nodes_with_transpositions(self):
+        result = (MCTS(TicTacToeGame, transpositions=1000, max_nodes=100)
+                  .get_simulation_result(1000))
+        self.assertEqual(result.root.visits, 1000)
+        self.assertEqual(result.root.budget.nodes, tree_size(result.root))
+
+    def test_prune(self):
+        for rollout in [False, True]:
+            mcts = MCTS(TicTacToeGame, rollout=rollout, seed=4,
+                        max_nodes=100, prune=True)
+            with mcts.search(1000) as search:
+                sizes = []
+                while not search.done:
+                    search.run(1)
+                    sizes.append(tree_size(search.root))
+                    self.assertEqual(search.root.budget.nodes, sizes[-1])
+            self.assertTrue(max(sizes) <= 100 + 8)
+            # the tree was pruned and grew again
+            self.assertTrue(any(size < before
+                                for before, size in zip(sizes, sizes[1:])))
+            self.assertEqual(search.root.visits, 1000)
+            self.assertEqual(len(search.root.children), 9)
+
+    def test_advance_recounts_the_kept_subtree(self):
+        mcts = MCTS(TicTacToeGame, max_nodes=1000)
+        result = mcts.get_simulation_result(500)
+        mcts.advance(result.move)
+        with mcts.search(10) as search:
+            self.assertEqual(search.root.budget.nodes,
+                             tree_size(search.root))
+
+    def test_prune_needs_max_nodes(self):
+        with self.assertRaises(ValueError):
+            MCTS(TicTacToeGame, prune=True)
+
+    def flamegraph_lines(self, result, depth=None):
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            flamegraph(result, depth)
+        return sorted(stdout.getvalue().splitlines())
+
+    def test_walks_match_the_leaf_nodes(self):
+        for rollout in [False, True]:
+            result = (MCTS(TicTacToeGame, seed=6, rollout=rollout)
+                      .get_simulation_result(300, get_leaf_nodes=True,
+                                             get_walks=True))
+            self.assertEqual(sum(result.walks.values()), 300)
+            from_leaf_nodes = result._replace(walks=None)
+            self.assertEqual(self.flamegraph_lines(result),
+                             self.flamegraph_lines(from_leaf_nodes))
+            self.assertEqual(self.flamegraph_lines(result, 3),
+                             self.flamegraph_lines(from_leaf_nodes, 3))
+
+    def test_walks(self):
+        ___ = None
+        state = TicTacToeGame.State(board=['O', 'O', ___,
+                                           'X', ___, 'X',
+                                           'O', 'X', 'X'],
+                                    current_player='O',
+                                    winner=None)
+        result = (MCTS(TicTacToeGame, state)
+                  .get_simulation_result(100, get_walks=True))
+        self.assertEqual(set(result.walks), set(['2;O-win',
+                                                 '4;2-opp;O-lose']))
+        self.assertEqual(result.leaf_nodes, [])
+
+    def test_walk_depth(self):
+        result = (MCTS(TicTacToeGame)
+                  .get_simulation_result(200, get_walks=True, walk_depth=2))
+        self.assertEqual(sum(result.walks.values()), 200)
+        for walk in result.walks:
+            self.assertEqual(len(walk.split(';')), 2)
+
+    def test_root_parallel_walks(self):
+        result = (MCTS(TicTacToeGame)
+                  .get_simulation_result(100, processes=2, get_walks=True,
+                                         walk_depth=1))
+        self.assertEqual(sum(result.walks.values()), 100)
+        self.assertEqual(set(result.walks),
+                         set(str(move) for move in range(9)))
+
+    def test_profile(self):
+        result = (MCTS(TicTacToeGame, rollout=True, solver=True, seed=1)
+                  .get_simulation_result(100))
+        self.assertIsNone(result.profile)
+        result = (MCTS(TicTacToeGame, rollout=True, solver=True, seed=1,
+                       profile=True)
+                  .get_simulation_result(100))
+        profile = result.profile.to_dict()
+        self.assertEqual(set(profile['phases']),
+                         set(['select', 'rollout', 'backprop', 'prove']))
+        self.assertEqual(profile['phases']['backprop']['calls'], 100)
+        self.assertTrue(profile['phases']['select']['seconds'] > 0)
+        self.assertEqual(set(profile['callbacks']),
+                         set(['apply_move', 'get_moves', 'get_winner',
+                              'current_player']))
+        # profiling does not change the search
+        unprofiled = (MCTS(TicTacToeGame, rollout=True, solver=True, seed=1)
+                      .get_simulation_result(100))
+        self.assertEqual(
+            [(child.move, child.visits) for child in result.root.children],
+            [(child.move, child.visits)
+             for child in unprofiled.root.children])
+
+    def test_profile_counts_every_phase_once(self):
+        result = (MCTS(TicTacToeGame, max_nodes=20, profile=True)
+                  .get_simulation_result(100))
+        phases = result.profile.to_dict()['phases']
+        self.assertEqual(phases['select']['calls'], 100)
+        self.assertEqual(phases['backprop']['calls'], 100)
+        # the tree fills up on the first iteration
+        self.assertEqual(phases['rollout']['calls'], 100)
+
+    def test_profile_of_every_search(self):
+        mcts = MCTS(SimpleDiceRollingGame, profile=True)
+        first = mcts.get_simulation_result(50)
+        second = mcts.get_simulation_result(20)
+        self.assertEqual(first.profile.to_dict()['phases']['backprop']
+                         ['calls'], 50)
+        self.assertEqual(second.profile.to_dict()['phases']['backprop']
+                         ['calls'], 20)
+
+    def test_profile_with_determine(self):
+        result = (MCTS(GameWithManyMovesOnlyOneDetermined, profile=True)
+                  .get_simulation_result(30))
+        profile = result.profile.to_dict()
+        self.assertEqual(profile['phases']['determine']['calls'], 30)
+        self.assertEqual(profile['callbacks']['determine']['calls'], 30)
+
+    def test_root_parallel_profile(self):
+        result = (MCTS(TicTacToeGame, profile=True)
+                  .get_simulation_result(100, processes=2))
+        self.assertEqual(result.profile.to_dict()['phases']['backprop']
+                         ['calls'], 100)
+
+    def test_profile_exporters(self):
+        profile = Profile()
+        profile.seconds['phase', 'select'] = 1.5
+        profile.calls['phase', 'select'] = 3
+        profile.seconds['callback', 'get_moves'] = 0.25
+        profile.calls['callback', 'get_moves'] = 10
+        self.assertEqual(profile.to_json(),
+                         '{"callbacks": {"get_moves": {"calls": 10, '
+                         '"seconds": 0.25}}, "phases": {"select": '
+                         '{"calls": 3, "seconds": 1.5}}}')
+        self.assertEqual(
+            profile.to_prometheus(labels={'game': 'tictactoe'}).splitlines(),
+            ['# HELP mittmcts_seconds_total Time spent per search phase '
+             'and game callback',
+             '# TYPE mittmcts_seconds_total counter',
+             'mittmcts_seconds_total{game="tictactoe",kind="callback",'
+             'name="get_moves"} 0.25',
+             'mittmcts_seconds_total{game="tictactoe",kind="phase",'
+             'name="select"} 1.5',
+             '# HELP mittmcts_calls_total Calls per search phase and game '
+             'callback',
+             '# TYPE mittmcts_calls_total counter',
+             'mittmcts_calls_total{game="tictactoe",kind="callback",'
+             'name="get_moves"} 10',
+             'mittmcts_calls_total{game="tictactoe",kind="phase",'
+             'name="select"} 3'])
+
+    def test_threads(self):
+        result = (MCTS(ThreadedTicTacToeGame, self.one_move_from_winning(),
+                       rollout=True, seed=1)
+                  .get_simulation_result(500, threads=4, get_walks=True))
+        self.assertEqual(result.move, 2)
+        self.assertEqual(result.root.visits, 500)
+        self.assertEqual(sum(result.walks.values()), 500)
+        nodes = [result.root]
+        while nodes:
+            node = nodes.pop()
+            self.assertEqual(node.virtual_visits, 0)
+            nodes.extend(node.expanded_children)
+
+    def test_threads_with_solver(self):
+        result = (MCTS(ThreadedTicTacToeGame, self.one_move_from_winning(),
+                       rollout=True, solver=True)
+                  .get_simulation_result(100000, threads=4))
+        self.assertEqual(result.root.proven, 'O')
+        self.assertEqual(result.move, 2)
+        self.assertTrue(result.iterations_saved > 0)
+
+    def test_threads_stop_at_the_deadline(self):
+        result = (MCTS(ThreadedTicTacToeGame, rollout=True)
+                  .get_simulation_result(max_seconds=0.05, threads=2))
+        self.assertTrue(result.root.visits > 0)
+
+    def test_threads_need_a_shared_tree(self):
+        with self.assertRaises(ValueError):
+            MCTS(TicTacToeGame).get_simulation_result(10, threads=2)
+        with self.assertRaises(ValueError):
+            (MCTS(GameWithManyMovesOnlyOneDetermined, rollout=True)
+             .get_simulation_result(10, threads=2))
+        with self.assertRaises(ValueError):
+            (MCTS(TicTacToeGame, rollout=True)
+             .get_simulation_result(10, threads=2, processes=2))
+
+    def test_thread_errors_are_raised(self):
+        with patch.object(ThreadedTicTacToeGame, 'get_winner',
+                          side_effect=RuntimeError('broken')):
+            with self.assertRaises(RuntimeError):
+                (MCTS(ThreadedTicTacToeGame, rollout=True)
+                 .get_simulation_result(10, threads=2))
+
+    def test_threads_fall_back_to_one_thread_with_a_gil(self):
+        with patch('mittmcts.gil_enabled', return_value=True):
+            with patch('mittmcts.Search.run_threads') as run_threads:
+                result = (MCTS(TicTacToeGame, rollout=True, seed=2)
+                          .get_simulation_result(200, threads=4))
+                self.assertFalse(run_threads.called)
+                (MCTS(ThreadedTicTacToeGame, rollout=True)
+                 .get_simulation_result(200, threads=4))
+                self.assertTrue(run_threads.called)
+        serial = (MCTS(TicTacToeGame, rollout=True, seed=2)
+                  .get_simulation_result(200))
+        self.assertEqual(
+            [(child.move, child.visits) for child in result.root.children],
+            [(child.move, child.visits) for child in serial.root.children])
+
+    def test_threads_without_a_gil(self):
+        with patch('mittmcts.gil_enabled', return_value=False):
+            with patch('mittmcts.Search.run_threads',
+                       return_value=0) as run_threads:
+                (MCTS(TicTacToeGame, rollout=True)
+                 .get_simulation_result(200, threads=4))
+        self.assertTrue(run_threads.called)
+
+    def test_virtual_loss_spreads_selection(self):
+        root = MCTS(GameWithTwoMoves).new_root()
+        first, second = root.children
+        for child in root.children:
+            child.visits = 10
+            child.wins_by_player[root.current_player] = 5
+        root.visits = 20
+        root.virtual_visits = 1
+        first.virtual_visits = 1
+        self.assertIs(root.get_best_child(), second)
+        first.virtual_visits = 0
+        second.virtual_visits = 1
+        self.assertIs(root.get_best_child(), first)
+
+    def test_evaluator(self):
+        batches = []
+
+        def evaluator(states):
+            batches.append(len(states))
+            evaluations = []
+            for state in states:
+                # no idea who is ahead but the middle square looks best
+                _, moves = TicTacToeGame.get_moves(state)
+                priors = dict((move, 1.0 / (len(moves) + 1))
+                              for move in moves)
+                if 4 in priors:
+                    priors[4] *= 2
+                evaluations.append(({'X': 0.5, 'O': 0.5}, priors))
+            return evaluations
+        result = (MCTS(TicTacToeGame, evaluator=evaluator, batch_size=8,
+                       seed=2)
+                  .get_simulation_result(200))
+        self.assertEqual(result.root.visits, 200)
+        self.assertEqual(result.move, 4)
+        self.assertEqual(max(batches), 8)
+        self.assertEqual(result.root.priors[4], 0.2)
+        nodes = [result.root]
+        while nodes:
+            node = nodes.pop()
+            self.assertEqual(node.virtual_visits, 0)
+            nodes.extend(node.expanded_children)
+
+    def test_evaluator_does_not_evaluate_terminal_states(self):
+        evaluated = []
+
+        def evaluator(states):
+            evaluated.extend(states)
+            return [({1: 0.5, 2: 0.5}, None) for _ in states]
+        result = (MCTS(GameWithTwoMoves, evaluator=evaluator, batch_size=4)
+                  .get_simulation_result(50))
+        self.assertEqual(result.move, 1)
+        self.assertTrue(all(GameWithTwoMoves.get_winner(state) is None
+                            for state in evaluated))
+        self.assertEqual(result.root.visits, 50)
+
+    def test_evaluator_values_are_backpropagated(self):
+        state = self.one_move_from_winning()
+        result = (MCTS(TicTacToeGame, state,
+                       evaluator=lambda states: [({'O': 1, 'X': 0}, None)
+                                                 for _ in states])
+                  .get_simulation_result(1))
+        self.assertEqual(result.root.visits, 1)
+        self.assertEqual(result.root.wins_by_player['O'], 1)
+        self.assertEqual(result.root.priors, {})
+
+    def test_evaluator_with_determine(self):
+        result = (MCTS(GameWithManyMovesOnlyOneDetermined,
+                       evaluator=lambda states: [({1: 0.5, 2: 0.5}, None)
+                                                 for _ in states],
+                       batch_size=4)
+                  .get_simulation_result(50))
+        self.assertEqual(result.root.visits, 50)
+
+    def test_evaluator_replaces_rollouts(self):
+        with self.assertRaises(ValueError):
+            MCTS(TicTacToeGame, rollout=True, evaluator=lambda states: [])
+
+    def test_closed_batch_leaves_no_virtual_loss(self):
+        mcts = MCTS(TicTacToeGame,
+                    evaluator=lambda states: [({'X': 0.5, 'O': 0.5}, None)
+                                              for _ in states],
+                    batch_size=8)
+        with mcts.search(10) as search:
+            search.run()
+            self.assertEqual(search.plays, 10)
+        self.assertEqual(search.root.visits, 10)
+        self.assertEqual(search.root.virtual_visits, 0)
+
+    def test_progressive_widening(self):
+        for rollout in [False, True]:
+            result = (MCTS(TicTacToeGame, widening=(1, 0.5), rollout=rollout)
+                      .get_simulation_result(25))
+            # the root is selected from with 0 to 24 visits so a child is
+            # added at 0, 4, 9 and 16 visits
+            self.assertEqual(len(result.root.expanded_children), 4)
+            self.assertEqual(result.root.visits, 25)
+            # reading the children after the search adds no child
+            result.root.children
+            result.root.most_visited_child()
+            self.assertEqual(len(result.root.expanded_children), 4)
+        result = (MCTS(TicTacToeGame, self.one_move_from_winning(),
+                       widening=(1, 0.5))
+                  .get_simulation_result(500))
+        self.assertEqual(result.move, 2)
+
+    def test_widening_respects_the_node_budget(self):
+        for rollout in [False, True]:
+            result = (MCTS(TicTacToeGame, widening=(2, 0.5), max_nodes=50,
+                           rollout=rollout)
+                      .get_simulation_result(300))
+            self.assertTrue(tree_size(result.root) <= 50)
+
+    def test_widening_tries_the_most_likely_moves_first(self):
+        def evaluator(states):
+            return [({'X': 0.5, 'O': 0.5}, {7: 0.6, 4: 0.4})
+                    for _ in states]
+        result = (MCTS(TicTacToeGame, evaluator=evaluator, widening=(1, 0))
+                  .get_simulation_result(20))
+        self.assertEqual([child.move
+                          for child in result.root.expanded_children], [7])
+
+    def test_double_progressive_widening(self):
+        for rollout in [False, True]:
+            result = (MCTS(SimpleDiceRollingGame, chance_widening=(1, 0.25),
+                           rollout=rollout)
+                      .get_simulation_result(300))
+            self.assertEqual(result.move, 2)
+            for child in result.root.expanded_children:
+                # 300 ** 0.25 is about 4.2
+                self.assertTrue(len(child.expanded_children) <= 4)
+                # in rollout mode the first visit stops at the child
+                outcome_visits = sum(outcome.visits for outcome
+                                     in child.expanded_children)
+                self.assertTrue(child.visits - 1 <= outcome_visits <=
+                                child.visits)
@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from six import StringIO
+
+from mittmcts.tournament import (
+    MCTSAgent, RandomAgent, main, parse_agent, percentile, play_game,
+    run_match, wilson_interval
+)
+from test.euchre import EuchreGame
+from test.games import TicTacToeGame
+
+
+class TestTournament(unittest.TestCase):
+    def test_wilson_interval(self):
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(low, 0.4038, places=4)
+        self.assertAlmostEqual(high, 0.5962, places=4)
+        low, high = wilson_interval(0, 10)
+        self.assertEqual(low, 0)
+        self.assertAlmostEqual(high, 0.2775, places=4)
+        self.assertEqual(wilson_interval(0, 0), (0.0, 1.0))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([3], 0.9), 3)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_parse_agent(self):
+        agent = parse_agent('mcts:iterations=50,c=0.7,rollout=1')
+        self.assertEqual(agent.name, 'mcts:iterations=50,c=0.7,rollout=1')
+        self.assertEqual(agent.iterations, 50)
+        self.assertEqual(agent.options, {'c': 0.7, 'rollout': 1})
+        self.assertIsInstance(parse_agent('random'), RandomAgent)
+        with self.assertRaises(ValueError):
+            parse_agent('minimax')
+
+    def test_agent_names(self):
+        self.assertEqual(MCTSAgent(iterations=10, c=1).name,
+                         'mcts:c=1,iterations=10')
+
+    def test_run_match(self):
+        agents = [MCTSAgent(iterations=100), RandomAgent()]
+        output = StringIO()
+        results, summary = run_match(TicTacToeGame, agents, ['X', 'O'],
+                                     games=6, seed=3, output=output)
+        lines = [json.loads(line)
+                 for line in output.getvalue().splitlines()]
+        self.assertEqual([line['game'] for line in lines], list(range(6)))
+        # the agents take turns going first
+        self.assertEqual([result['seats'][0][1] for result in results],
+                         [agents[0].name, agents[1].name] * 3)
+        mcts, random = summary['agents']
+        self.assertEqual(summary['games'], 6)
+        self.assertEqual(mcts['games'], 6)
+        self.assertEqual(mcts['wins'], random['losses'])
+        self.assertEqual(mcts['draws'], random['draws'])
+        self.assertTrue(mcts['score'] > random['score'])
+        self.assertTrue(mcts['score_low'] <= mcts['score'] <=
+                        mcts['score_high'])
+        self.assertEqual(mcts['moves'] + random['moves'],
+                         sum(result['moves'] for result in results))
+        self.assertTrue(mcts['latency_p50'] <= mcts['latency_p99'])
+
+    def test_parallel_match_plays_the_same_games(self):
+        agents = [MCTSAgent(iterations=50), RandomAgent()]
+        serial, _ = run_match(TicTacToeGame, agents, ['X', 'O'], games=4)
+        parallel, summary = run_match(TicTacToeGame, agents, ['X', 'O'],
+                                      games=4, processes=2)
+        self.assertEqual([(result['winner'], result['moves'])
+                          for result in serial],
+                         [(result['winner'], result['moves'])
+                          for result in parallel])
+        self.assertTrue(summary['games_per_second'] > 0)
+
+    def test_agents_only_see_their_own_hand(self):
+        seen = []
+
+        class RecordingAgent(RandomAgent):
+            def choose(self, game, state, moves, random):
+                seen.append(state)
+                return RandomAgent.choose(self, game, state, moves, random)
+
+        seats = {0: RecordingAgent('a'), 1: RecordingAgent('b')}
+        result = play_game(EuchreGame, seats, seed=1)
+        self.assertEqual(result['moves'], 20)
+        self.assertEqual(len(seen), 20)
+        for state in seen:
+            for player, hand in enumerate(state.hands):
+                if player != state.current_player:
+                    self.assertEqual(hand, [])
+
+    def test_euchre_match(self):
+        agents = [MCTSAgent(iterations=20), RandomAgent()]
+        results, summary = run_match(EuchreGame, agents, [0, 1], games=2)
+        self.assertEqual([result['moves'] for result in results], [20, 20])
+
+    def test_main_writes_jsonl(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'games.jsonl')
+            summary = main(['--games', '4', '--agents', 'mcts:iterations=20',
+                            'random', '--jsonl', path])
+            with open(path) as output:
+                lines = output.read().splitlines()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(summary['games'], 4)
+
+    def test_main_with_an_agent_that_never_moves(self):
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            summary = main(['--game', 'connect4', '--games', '1',
+                            '--agents', 'mcts:iterations=20', 'random',
+                            'mcts:iterations=10'])
+        idle = summary['agents'][2]
+        self.assertEqual(idle['games'], 0)
+        self.assertIsNone(idle['latency_p50'])
+        row = stdout.getvalue().splitlines()[-1]
+        self.assertTrue(row.startswith('mcts:iterations=10 '))
+        self.assertEqual(row.split()[-2:], ['-', '-'])